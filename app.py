@@ -14,6 +14,8 @@ file_path = os.path.abspath(__file__)
 root_path = os.path.dirname(file_path)
 # 拼接Config文件地址
 egbenz_config_path = os.path.join(root_path, "egbenz.config.cfg")
+# 全文索引数据库地址
+egbenz_search_path = os.path.join(root_path, "egbenz.search.db")
 
 class EgbenzServer():
     def __init__(self) -> None:
@@ -26,8 +28,13 @@ class EgbenzServer():
         import uvicorn
 
         import server.apis.file_manage as fileRoute
+        import server.apis.file_service as fileService
         from server.apis.route import EgbenzRouter
-        from server.apis.chatgpt import route_chat, ResponseChat
+        from server.apis.forwarder import Forwarder
+        from server.apis.chat_client import ChatClientPool
+        from server.apis.chatgpt import route_chat, route_chat_stream, ResponseChat
+        from server.apis.file_watcher import FileWatcher, watch_files
+        from server.apis.search import SearchIndex, search, sync_workspace, ResponseSearch
 
         from fastapi.responses import FileResponse
         def get_vite_svg():
@@ -35,6 +42,32 @@ class EgbenzServer():
 
         self.app = FastAPI()
         self.router = APIRouter()
+        # 服务运行在子进程中，atexit不会执行，退出前写入尚未写入的配置
+        self.app.add_event_handler("shutdown", global_obj.config.flush)
+
+        # 文件接口使用的专用线程池
+        global_obj.register('file_service', fileService.FileService())
+        self.app.add_event_handler("shutdown", global_obj.file_service.shutdown)
+
+        # 工作目录文件监听，变化通过/watch推送给客户端
+        self.watcher = FileWatcher()
+        global_obj.register('watcher', self.watcher)
+        self.app.add_event_handler("startup", self.watcher.start)
+        self.app.add_event_handler("shutdown", self.watcher.stop)
+
+        # SD/VITS转发使用的连接池
+        global_obj.register('forwarder', Forwarder())
+        self.app.add_event_handler("startup", global_obj.forwarder.start)
+        self.app.add_event_handler("shutdown", global_obj.forwarder.close)
+
+        # 聊天接口共用的连接池
+        global_obj.register('chat_clients', ChatClientPool())
+        self.app.add_event_handler("shutdown", global_obj.chat_clients.close)
+
+        # .ai文档全文索引，后台线程写入索引，启动及工作目录修改后同步工作目录
+        global_obj.register('search_index', SearchIndex(egbenz_search_path))
+        self.app.add_event_handler("startup", sync_workspace)
+        self.app.add_event_handler("shutdown", global_obj.search_index.close)
 
         if not dev:
             from fastapi.staticfiles import StaticFiles
@@ -50,16 +83,26 @@ class EgbenzServer():
             self.app.add_api_route("/", read_root, response_class=HTMLResponse)
             self.app.add_api_route("/vite.svg", get_vite_svg)
 
-        self.app.add_api_route("/files", fileRoute.get_all_files, methods=["POST"], response_model=fileRoute.ResponsePath)
-        self.app.add_api_route("/file", fileRoute.get_file, methods=["POST"], response_model=fileRoute.ResponseFile)
-        self.app.add_api_route("/new_folder", fileRoute.new_folder, methods=["POST"], response_model=fileRoute.ResponseNewFolder)
-        self.app.add_api_route("/new_ai_file", fileRoute.new_ai_file, methods=["POST"], response_model=fileRoute.ResponseNewFile)
-        self.app.add_api_route("/update_file", fileRoute.update_file, methods=["POST"], response_model=fileRoute.ResponseUpdateFile)
-        self.app.add_api_route("/refresh", fileRoute.get_folders, methods=["POST"], response_model=fileRoute.ResponseFolders)
-        self.app.add_api_route("/delete_path", fileRoute.delete_path, methods=["POST"], response_model=fileRoute.ResponseDeletePath)
-        self.app.add_api_route("/rename_path", fileRoute.rename_path, methods=["POST"], response_model=fileRoute.ResponseRenamePath)
+        self.app.add_api_route("/files", fileService.get_all_files, methods=["POST"], response_model=fileRoute.ResponsePath)
+        self.app.add_api_route("/file", fileService.get_file_raw, methods=["POST"], response_model=fileRoute.ResponseFile)
+        self.app.add_api_route("/file_page", fileService.get_file_page, methods=["POST"], response_model=fileRoute.ResponseFilePage)
+        self.app.add_api_route("/file_children", fileService.get_file_children, methods=["POST"], response_model=fileRoute.ResponseFileChildren)
+        self.app.add_api_route("/new_folder", fileService.new_folder, methods=["POST"], response_model=fileRoute.ResponseNewFolder)
+        self.app.add_api_route("/new_ai_file", fileService.new_ai_file, methods=["POST"], response_model=fileRoute.ResponseNewFile)
+        self.app.add_api_route("/update_file", fileService.update_file, methods=["POST"], response_model=fileRoute.ResponseUpdateFile)
+        self.app.add_api_route("/patch_file", fileService.patch_file, methods=["POST"], response_model=fileRoute.ResponsePatchFile)
+        self.app.add_api_route("/batch", fileService.batch, methods=["POST"], response_model=fileRoute.ResponseBatch)
+        self.app.add_api_route("/tree", fileService.get_tree, methods=["POST"], response_model=fileRoute.ResponseTree)
+        self.app.add_api_route("/refresh", fileService.get_folders, methods=["POST"], response_model=fileRoute.ResponseFolders)
+        self.app.add_api_route("/delete_path", fileService.delete_path, methods=["POST"], response_model=fileRoute.ResponseDeletePath)
+        self.app.add_api_route("/rename_path", fileService.rename_path, methods=["POST"], response_model=fileRoute.ResponseRenamePath)
+        self.app.add_api_route("/egbenz_assets/{name}", fileRoute.get_asset, methods=["GET"])
+        self.app.add_api_route("/watch", watch_files, methods=["GET"])
+        self.app.add_api_route("/search", search, methods=["POST"], response_model=ResponseSearch)
+        self.app.add_api_route("/cache_stats", fileRoute.get_cache_stats, methods=["POST"], response_model=fileRoute.ResponseCacheStats)
         
         self.app.add_api_route("/chatgpt", route_chat, methods=["POST"], response_model=ResponseChat)
+        self.app.add_api_route("/chatgpt/stream", route_chat_stream, methods=["POST"])
         self.egbenzRouter = EgbenzRouter(self.app)
 
         self.app.include_router(self.router)
@@ -68,7 +111,9 @@ class EgbenzServer():
 
 class StableServer():
     def __init__(self) -> None:
-        pass
+        # 每个进程持有自己的配置，配置文件修改后自动重新加载
+        from server.apis.config import Config
+        global_obj.register('config', Config(egbenz_config_path))
     
     def startSever(self, port=8081):
         from fastapi import FastAPI, Response, APIRouter, Depends, Request
@@ -78,13 +123,15 @@ class StableServer():
         self.hijackApi = hijackApi
         self.app = FastAPI()
         self.router = APIRouter()
+        self.app.add_event_handler("shutdown", global_obj.config.flush)
         self.sd_api = self.hijackApi(self.app)
         self.app.include_router(self.router)
         uvicorn.run(self.app, host="0.0.0.0", port=port)
 
 class VitsServer():
     def __init__(self) -> None:
-        pass
+        from server.apis.config import Config
+        global_obj.register('config', Config(egbenz_config_path))
 
     def startServer(self, port=8083):
         from fastapi import FastAPI, Response, APIRouter, Depends, Request
@@ -94,6 +141,7 @@ class VitsServer():
         self.VITSHijack = VITSHijack
         self.app = FastAPI()
         self.router = APIRouter()
+        self.app.add_event_handler("shutdown", global_obj.config.flush)
         self.vits = self.VITSHijack(self.app)
         self.app.include_router(self.router)
         uvicorn.run(self.app, host="0.0.0.0", port=port)
@@ -0,0 +1,181 @@
+import json
+
+# .ai文档的存储格式
+# json: 原来的JSON文本
+# compact: 文件头 + msgpack，节点名、type、style以及节点的key顺序都放入字符串表/样式表/结构表，节点只保存下标
+# compact+zstd: 在compact基础上使用zstd压缩
+# 读取时根据文件头自动识别格式
+
+# msgpack/zstandard/orjson均为可选依赖
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FORMAT_JSON = "json"
+FORMAT_COMPACT = "compact"
+FORMAT_COMPACT_ZSTD = "compact+zstd"
+FORMATS = (FORMAT_JSON, FORMAT_COMPACT, FORMAT_COMPACT_ZSTD)
+
+# 文件头: 4字节标识 + 1字节版本 + 1字节标志位
+MAGIC = b"EGBZ"
+VERSION = 1
+HEADER_SIZE = len(MAGIC) + 2
+FLAG_ZSTD = 0x01
+
+# 结构表中key的前缀，表示该字段的值需要转换
+_KEY_STRING = "\x00"
+_KEY_STYLE = "\x01"
+_KEY_CHILDREN = "\x02"
+_STRING_KEYS = ("name", "type")
+
+def json_dumps_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf8')
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def is_compact(data):
+    return data[:len(MAGIC)] == MAGIC
+
+def sniff_file(path):
+    """根据文件头判断文件格式，文件不存在时返回None
+    """
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+    except OSError:
+        return None
+    if not is_compact(header):
+        return FORMAT_JSON
+    if len(header) == HEADER_SIZE and header[-1] & FLAG_ZSTD:
+        return FORMAT_COMPACT_ZSTD
+    return FORMAT_COMPACT
+
+# 估算解码后大小需要读取的文件开头字节数: 文件头 + zstd帧头(最长18字节)
+SIZE_HEAD_BYTES = HEADER_SIZE + 18
+
+def decoded_size(head, size):
+    """估算文档解码后的字节数，用于统计缓存占用
+    compact+zstd为解压后的msgpack长度(从zstd帧头读取)，其他格式为文件大小
+    head为文件开头的字节(至少SIZE_HEAD_BYTES)，size为文件大小
+    """
+    if is_compact(head) and len(head) > HEADER_SIZE and head[len(MAGIC) + 1] & FLAG_ZSTD and zstandard is not None:
+        try:
+            content_size = zstandard.frame_content_size(head[HEADER_SIZE:SIZE_HEAD_BYTES])
+        except zstandard.ZstdError:
+            content_size = -1
+        if content_size > 0:
+            return HEADER_SIZE + content_size
+    return size
+
+class _Encoder:
+    def __init__(self):
+        self.strings, self._string_index = [], {}
+        self.styles, self._style_index = [], {}
+        self.shapes, self._shape_index = [], {}
+
+    def _intern(self, table, index, key, value):
+        if key not in index:
+            index[key] = len(table)
+            table.append(value)
+        return index[key]
+
+    def node(self, node):
+        shape = []
+        values = []
+        for key, value in node.items():
+            if key in _STRING_KEYS and isinstance(value, str):
+                shape.append(_KEY_STRING + key)
+                values.append(self._intern(self.strings, self._string_index, value, value))
+            elif key == "style" and isinstance(value, dict):
+                shape.append(_KEY_STYLE + key)
+                style_key = json.dumps(value, sort_keys=False, ensure_ascii=False)
+                values.append(self._intern(self.styles, self._style_index, style_key, value))
+            elif key == "children" and isinstance(value, list) and all(isinstance(child, dict) for child in value):
+                shape.append(_KEY_CHILDREN + key)
+                values.append([self.node(child) for child in value])
+            else:
+                shape.append(key)
+                values.append(value)
+        shape_index = self._intern(self.shapes, self._shape_index, tuple(shape), shape)
+        return [shape_index] + values
+
+def _decode_node(encoded, strings, styles, shapes):
+    node = {}
+    shape = shapes[encoded[0]]
+    for key, value in zip(shape, encoded[1:]):
+        prefix = key[:1]
+        if prefix == _KEY_STRING:
+            node[key[1:]] = strings[value]
+        elif prefix == _KEY_STYLE:
+            # 样式表中的dict被多个节点共用，复制后返回，避免修改一个节点影响其他节点
+            node[key[1:]] = dict(styles[value])
+        elif prefix == _KEY_CHILDREN:
+            node[key[1:]] = [_decode_node(child, strings, styles, shapes) for child in value]
+        else:
+            node[key] = value
+    return node
+
+def available_format(fmt):
+    """缺少依赖时退化为可用的格式: compact+zstd -> compact -> json
+    """
+    if fmt not in FORMATS or msgpack is None:
+        return FORMAT_JSON
+    if fmt == FORMAT_COMPACT_ZSTD and zstandard is None:
+        return FORMAT_COMPACT
+    return fmt
+
+def dumps(doc, fmt=FORMAT_JSON):
+    """把文档编码为指定格式的字节串
+    """
+    if fmt == FORMAT_JSON:
+        return json_dumps_bytes(doc)
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的文档格式: {fmt}")
+    if msgpack is None:
+        raise RuntimeError("compact格式需要安装msgpack")
+    encoder = _Encoder()
+    root = encoder.node(doc)
+    body = msgpack.packb([encoder.strings, encoder.styles, encoder.shapes, root], use_bin_type=True)
+    flags = 0
+    if fmt == FORMAT_COMPACT_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("compact+zstd格式需要安装zstandard")
+        body = zstandard.ZstdCompressor().compress(body)
+        flags |= FLAG_ZSTD
+    return MAGIC + bytes([VERSION, flags]) + body
+
+def loads(data):
+    """根据文件头解码文档，没有文件头时按JSON解析
+    """
+    if not is_compact(data):
+        return json_loads(data)
+    if msgpack is None:
+        raise RuntimeError("读取compact格式需要安装msgpack")
+    version, flags = data[len(MAGIC)], data[len(MAGIC) + 1]
+    if version != VERSION:
+        raise ValueError(f"不支持的文档格式版本: {version}")
+    body = data[HEADER_SIZE:]
+    if flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("读取compact+zstd格式需要安装zstandard")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    strings, styles, shapes, root = msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return _decode_node(root, strings, styles, shapes)
+
+def load_file(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
@@ -0,0 +1,51 @@
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+# 原子写入: 先写入同目录下的临时文件并fsync，再用os.replace替换目标文件，写入过程中崩溃不会留下被截断的文件
+# 临时文件以'.'开头，不会出现在文件列表中
+
+# 新建文件的默认权限(与open(path, 'w')创建的文件一致)
+_umask = os.umask(0)
+os.umask(_umask)
+DEFAULT_FILE_MODE = 0o666 & ~_umask
+
+@contextmanager
+def open_atomic(path, mode='wb', encoding=None):
+    """打开临时文件用于逐块写入，with块正常结束后替换目标文件，出错时删除临时文件，目标文件保持不变
+    已存在的文件保持原来的权限
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp创建的文件只有当前用户可读写，保持原文件权限
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = DEFAULT_FILE_MODE
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 目录项也需要落盘，windows不支持对目录fsync
+    if os.name != 'nt':
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def write_atomic(path, data):
+    """原子写入字节串
+    """
+    with open_atomic(path) as f:
+        f.write(data)
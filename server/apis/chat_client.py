@@ -0,0 +1,172 @@
+import json
+import time
+import traceback
+from collections import deque
+
+import httpx
+from fastapi.responses import StreamingResponse
+
+from server.globalObject import global_obj
+
+# 聊天接口(ChatGPT等)共用的HTTP客户端
+# 按代理地址复用httpx.AsyncClient并保持长连接，大量并发的聊天请求不占用线程池；安装h2时启用HTTP/2
+try:
+    import h2
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+CHAT_MAX_CONNECTIONS = 200
+CHAT_MAX_KEEPALIVE = 20
+# 空闲连接保持时间(秒)
+CHAT_KEEPALIVE_EXPIRY = 60
+CHAT_CONNECT_TIMEOUT = 10
+# 模型生成回复可能需要较长时间
+CHAT_TIMEOUT = 300
+
+class ChatClientPool:
+    def __init__(self, max_connections=CHAT_MAX_CONNECTIONS, max_keepalive=CHAT_MAX_KEEPALIVE, keepalive_expiry=CHAT_KEEPALIVE_EXPIRY):
+        self.limits = httpx.Limits(
+            max_connections=max_connections
+            , max_keepalive_connections=max_keepalive
+            , keepalive_expiry=keepalive_expiry
+        )
+        # 代理地址 -> 客户端，""为直连
+        self._clients = {}
+
+    def get(self, proxy=None):
+        """返回使用指定代理的客户端，proxy为空时直连
+        """
+        key = proxy or ""
+        client = self._clients.get(key)
+        if client is None:
+            kwargs = {}
+            if proxy:
+                kwargs["proxies"] = {
+                    "http://": f"http://{proxy}"
+                    , "https://": f"http://{proxy}"
+                }
+            client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED
+                , limits=self.limits
+                , timeout=httpx.Timeout(CHAT_TIMEOUT, connect=CHAT_CONNECT_TIMEOUT)
+                , **kwargs
+            )
+            self._clients[key] = client
+        return client
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+def get_chat_client(proxy=None):
+    return global_obj.chat_clients.get(proxy)
+
+class ChatError(Exception):
+    """模型接口返回的错误
+    """
+    pass
+
+# 每个模型保留的最近耗时样本数
+CHAT_METRICS_SAMPLES = 200
+
+def _summary(samples):
+    if not samples:
+        return {"count": 0}
+    values = sorted(samples)
+    return {
+        "count": len(values)
+        , "avg": round(sum(values) / len(values), 1)
+        , "p50": values[len(values) // 2]
+        , "p95": values[min(int(len(values) * 0.95), len(values) - 1)]
+        , "last": samples[-1]
+    }
+
+class ChatMetrics:
+    """流式聊天的首字延迟(TTFT)和总耗时统计(毫秒)
+    """
+    def __init__(self, samples=CHAT_METRICS_SAMPLES):
+        self.samples = samples
+        self._providers = {}
+
+    def record(self, provider, ttft, total, error=False):
+        metrics = self._providers.setdefault(provider, {
+            "requests": 0
+            , "errors": 0
+            , "ttft": deque(maxlen=self.samples)
+            , "total": deque(maxlen=self.samples)
+        })
+        metrics["requests"] += 1
+        if error:
+            metrics["errors"] += 1
+        if ttft is not None:
+            metrics["ttft"].append(round(ttft * 1000, 1))
+        metrics["total"].append(round(total * 1000, 1))
+
+    def stats(self):
+        return {provider: {
+            "requests": metrics["requests"]
+            , "errors": metrics["errors"]
+            , "ttft_ms": _summary(list(metrics["ttft"]))
+            , "total_ms": _summary(list(metrics["total"]))
+        } for provider, metrics in self._providers.items()}
+
+chat_metrics = ChatMetrics()
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def response_list(name, text):
+    """聊天接口返回的contents
+    """
+    return [{
+        "type": "text",
+        "name": name,
+        "role": "assistant",
+        "data": [{
+            "type": "text",
+            "text": text
+        }]
+    }]
+
+async def _chat_events(provider, name, deltas):
+    start = time.perf_counter()
+    ttft = None
+    texts = []
+    status = True
+    msg = ""
+    try:
+        async for text in deltas:
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            texts.append(text)
+            yield _sse({"type": "delta", "text": text})
+    except ChatError as e:
+        status = False
+        msg = str(e)
+    except Exception as e:
+        traceback.print_exc()
+        status = False
+        msg = str(e)
+    total = time.perf_counter() - start
+    chat_metrics.record(provider, ttft, total, error=not status)
+    # 结束事件的contents与非流式接口一致，出错且没有回复时文本为错误信息
+    yield _sse({
+        "type": "done"
+        , "status": status
+        , "message": msg
+        , "contents": response_list(name, "".join(texts) or msg)
+        , "ttft_ms": None if ttft is None else round(ttft * 1000, 1)
+        , "total_ms": round(total * 1000, 1)
+    })
+
+def chat_stream_response(provider, name, deltas):
+    """把模型的增量回复(异步生成器，产生文本片段)转换为SSE
+    每个片段为一个delta事件，最后为done事件(包含完整的contents和耗时)
+    """
+    return StreamingResponse(
+        _chat_events(provider, name, deltas)
+        , media_type="text/event-stream"
+        , headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,15 @@
+import json
 import time
-import requests
 
 from pydantic import BaseModel, Field
 from typing import Dict, List, Optional
 import traceback
 
 from server.globalObject import global_obj
+from server.apis.chat_client import ChatError, chat_stream_response, get_chat_client, response_list
+
+DEFAULT_CHATGPT_URL = "https://api.openai.com/v1/chat/completions"
+CHAT_MODEL = "gpt-3.5-turbo"
 
 # 模型管理
 class ParamsChat(BaseModel):
@@ -17,82 +21,88 @@ class ResponseChat(BaseModel):
     message: Optional[str] = Field(default="")
     contents: Optional[List] = Field(default=[])
 
-def route_chat(params:ParamsChat):
+async def route_chat(params:ParamsChat):
     try:
-        r,msg,r_lists = chat(params.text, params.history)
+        r,msg,r_lists = await chat(params.text, params.history)
         return ResponseChat(status=r, message=msg, contents=r_lists)
     
     except Exception as e:
         traceback.print_exc()
         return ResponseChat(status=False, message=str(e), contents=[])
 
-def chat(_prompt, history=[], system="",api_key=None, proxy=None, jump_url=None):
+async def route_chat_stream(params:ParamsChat):
+    """流式返回回复，SSE事件: delta(文本片段)，done(与/chatgpt相同的contents，以及首字延迟ttft_ms)
+    """
+    return chat_stream_response("chatgpt", CHAT_MODEL or "GPT-3.5", chat_deltas(params.text, params.history))
+
+def _chat_request(_prompt, history=[], system="", api_key=None, proxy=None, jump_url=None, stream=False):
+    """构造ChatGPT请求，返回(请求地址, 代理, 请求头, 请求体)
+    """
     if not api_key:
         api_key = global_obj.config.get("ChatGPT Key")
     if not proxy:
         proxy = global_obj.config.get("GPT Proxy")
     if not jump_url:
         jump_url = global_obj.config.get("JUMP URL")
-    
-    default_chatgpt_url = "https://api.openai.com/v1/chat/completions"
+
+    max_history = 50
+    prompt = []
+    if len(history) > 0:
+        i = 0
+        filtered_data = []
+        for obj in history:
+            if i < max_history:
+                filtered_data.append(obj)
+            else:
+                break
+            i+=1
+        prompt += filtered_data
+
+    if len(system) > 0:
+        prompt.insert(0, {
+            "role": "system",
+            "content": system
+        })
+
+    prompt.append({
+        "role": "user",
+        "content": _prompt
+    })
+
+    data = {
+        "messages": prompt,
+        "model": CHAT_MODEL,
+        "max_tokens": 1000,
+        "temperature": 0.5,
+        "top_p": 1,
+        "n": 1
+    }
+    if stream:
+        data["stream"] = True
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+
+    # 使用共享的连接池，设置代理时使用走代理的客户端
+    if(not proxy or len(proxy) < 1) and (not jump_url or len(jump_url) < 1):
+        return DEFAULT_CHATGPT_URL, None, headers, data
+    elif(not proxy or len(proxy) < 1):
+        return jump_url, None, headers, data
+    else:
+        return proxy, proxy, headers, data
+
+async def chat(_prompt, history=[], system="",api_key=None, proxy=None, jump_url=None):
     msg = ""
     response_text = ""
     response_flag = False
-    response_list = []
-    max_history = 50
     try:
-        prompt = []
-        if len(history) > 0:
-            i = 0
-            filtered_data = []
-            for obj in history:
-                if i < max_history:
-                    filtered_data.append(obj)
-                else:
-                    break
-                i+=1
-            prompt += filtered_data
-
-        if len(system) > 0:
-            prompt.insert(0, {
-                "role": "system",
-                "content": system
-            })
-
-        prompt.append({
-            "role": "user",
-            "content": _prompt
-        })
-
-        data = {
-            "messages": prompt,
-            "model":"gpt-3.5-turbo",
-            "max_tokens": 1000,
-            "temperature": 0.5,
-            "top_p": 1,
-            "n": 1
-        }
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}",
-        }
-
-        proxies = {
-            'http': f'http://{proxy}',
-            'https': f'http://{proxy}',
-        }
-        if(not proxy or len(proxy) < 1) and (not jump_url or len(jump_url) < 1):
-            response = requests.post(default_chatgpt_url, headers=headers, json=data)
-        elif(not proxy or len(proxy) < 1):
-            response = requests.post(jump_url, headers=headers, json=data)
-        else:
-            response = requests.post(proxy, headers=headers, json=data, proxies=proxies)
+        url, client_proxy, headers, data = _chat_request(_prompt, history, system, api_key, proxy, jump_url)
+        response = await get_chat_client(client_proxy).post(url, headers=headers, json=data)
 
         response_json = response.json()
         response_text = ""
-        response_list = []
-        
 
         try:
             if 'choices' in response_json:
@@ -112,19 +122,37 @@ def chat(_prompt, history=[], system="",api_key=None, proxy=None, jump_url=None)
     except Exception as e:
         msg = response_text = str(e)
         response_flag = False
-    
-    response_list.append({
-        "type": "text",
-        "name": data["model"] or "GPT-3.5",
-        "role": "assistant",
-        "data": [{
-            "type": "text",
-            "text": response_text
-        }]
-    })
 
-    return response_flag, msg, response_list
+    return response_flag, msg, response_list(CHAT_MODEL or "GPT-3.5", response_text)
 
+def _error_message(body):
+    try:
+        return json.loads(body)['error']['message']
+    except Exception:
+        return body.decode('utf-8', errors='replace')
+
+async def chat_deltas(_prompt, history=[], system="", api_key=None, proxy=None, jump_url=None):
+    """以stream模式请求ChatGPT，逐个产生回复的文本片段
+    """
+    url, client_proxy, headers, data = _chat_request(_prompt, history, system, api_key, proxy, jump_url, stream=True)
+    async with get_chat_client(client_proxy).stream("POST", url, headers=headers, json=data) as response:
+        if response.status_code != 200:
+            raise ChatError(_error_message(await response.aread()))
+        # 每行为 "data: {...}"，以 "data: [DONE]" 结束
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                break
+            chunk = json.loads(payload)
+            if 'error' in chunk:
+                raise ChatError(chunk['error']['message'])
+            choices = chunk.get('choices') or []
+            if len(choices) > 0:
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
 
 
 if __name__ == '__main__':
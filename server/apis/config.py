@@ -1,3 +1,11 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from server.apis.atomic_file import write_atomic
 
 default_config = {
     "GPT Proxy":""
@@ -8,33 +16,128 @@ default_config = {
     , "VITS URL": "http://localhost:8083"
     , "QianFan API Key": ""
     , "QianFan Secret Key": ""
+    # 新建.ai文档的存储格式: json | compact | compact+zstd
+    , "AI Storage Format": "json"
 }
 
+# 修改配置后等待一段时间再写入文件，期间的多次修改合并为一次写入
+WRITE_DELAY = 0.2
+# 检查配置文件是否被其他进程修改的间隔(秒)
+WATCH_INTERVAL = 1
+
+# 尚未写入文件的删除操作
+_REMOVED = object()
+
 class Config:
-    def __init__(self, cfg_path):
+    """egbenz.config.cfg 配置
+    修改时复制整个字典后替换(读取不需要加锁)，修改加锁并合并写入，写入使用临时文件+替换；
+    后台线程检查配置文件的修改时间，被其他进程修改后重新加载；
+    version在配置内容变化时加1，依赖配置的缓存可以据此判断是否过期
+    """
+    def __init__(self, cfg_path, watch=True):
         self.cfg_path = cfg_path
         self.cfg = {}
+        self.version = 0
+        self._lock = threading.RLock()
+        # 尚未写入文件的修改: key -> value 或 _REMOVED
+        self._pending = {}
+        self._timer = None
+        # 最近一次读取或写入时配置文件的(修改时间, 大小)
+        self._file_state = None
         self.load_cfg()
+        # 退出前写入尚未写入的修改；multiprocessing子进程通过os._exit退出，不会执行atexit，
+        # 由子进程中的服务在shutdown事件中调用flush
+        if multiprocessing.parent_process() is None:
+            atexit.register(self.flush)
+        if watch:
+            threading.Thread(target=self._watch, name="egbenz-config-watch", daemon=True).start()
+
+    def _read_file(self):
+        cfg = {}
+        with open(self.cfg_path, 'r', encoding='utf8') as f:
+            st = os.fstat(f.fileno())
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                key, value = line.split('=', 1)
+                cfg[key.strip()] = value.strip()
+
+        # 检查是否缺少默认配置
+        for key, value in default_config.items():
+            if key not in cfg:
+                cfg[key] = value
+        return cfg, (st.st_mtime_ns, st.st_size)
+
+    def _write_file(self, cfg):
+        write_atomic(self.cfg_path, ''.join(f'{k} = {v}\n' for k, v in cfg.items()).encode('utf8'))
+        st = os.stat(self.cfg_path)
+        self._file_state = (st.st_mtime_ns, st.st_size)
+
+    def _apply_pending(self, cfg):
+        for key, value in self._pending.items():
+            if value is _REMOVED:
+                cfg.pop(key, None)
+            else:
+                cfg[key] = value
+        return cfg
+
+    def _replace(self, cfg):
+        if cfg != self.cfg:
+            self.cfg = cfg
+            self.version += 1
 
     def load_cfg(self):
-        try:
-            with open(self.cfg_path, 'r', encoding='utf8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line or line.startswith('#'):
-                        continue
-                    key, value = line.split('=')
-                    self.cfg[key.strip()] = value.strip()
-
-                # 检查是否缺少默认配置
-                for key, value in default_config.items():
-                    if key not in self.cfg:
-                        self.cfg[key] = value
-        except FileNotFoundError:
-            with open(self.cfg_path, 'w', encoding='utf8') as f:
-                for k, v in default_config.items():
-                    f.write(f'{k} = {v}\n')
-            self.cfg = default_config
+        """从文件重新加载配置，尚未写入文件的修改优先
+        """
+        with self._lock:
+            try:
+                cfg, self._file_state = self._read_file()
+            except FileNotFoundError:
+                # 配置文件不存在时写入当前配置(首次启动时为默认配置)
+                cfg = dict(self.cfg or default_config)
+                self._write_file(cfg)
+            self._replace(self._apply_pending(cfg))
+
+    def _watch(self):
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            try:
+                st = os.stat(self.cfg_path)
+                file_state = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                file_state = None
+            except OSError:
+                continue
+            if file_state != self._file_state:
+                try:
+                    self.load_cfg()
+                except Exception:
+                    traceback.print_exc()
+
+    def flush(self):
+        """把尚未写入的修改写入文件，写入前合并其他进程对文件的修改
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            try:
+                cfg, _ = self._read_file()
+            except FileNotFoundError:
+                cfg = dict(self.cfg)
+            cfg = self._apply_pending(cfg)
+            self._write_file(cfg)
+            self._pending = {}
+            self._replace(cfg)
+
+    def _schedule_write(self):
+        if self._timer is None:
+            self._timer = threading.Timer(WRITE_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
 
     def get_all(self):
         return self.cfg
@@ -43,14 +146,17 @@ class Config:
         return self.cfg.get(key)
 
     def set(self, key, value):
-        self.cfg[key] = value
-        with open(self.cfg_path, 'w', encoding='utf8') as f:
-            for k, v in self.cfg.items():
-                f.write(f'{k} = {v}\n')
+        with self._lock:
+            cfg = dict(self.cfg)
+            cfg[key] = value
+            self._pending[key] = value
+            self._replace(cfg)
+            self._schedule_write()
 
     def remove(self, key):
-        self.cfg.pop(key)
-        with open(self.cfg_path, 'w') as f:
-            for k, v in self.cfg.items():
-                f.write(f'{k} = {v}\n')
-
+        with self._lock:
+            cfg = dict(self.cfg)
+            cfg.pop(key)
+            self._pending[key] = _REMOVED
+            self._replace(cfg)
+            self._schedule_write()
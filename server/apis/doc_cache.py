@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+
+class DocumentCache:
+    """按字节数限制大小的LRU文档缓存
+    key为文件绝对路径，条目记录文件的(修改时间, 大小)，不一致时视为未命中;
+    占用大小由调用方估算，默认为文件在磁盘上的字节数
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, mtime_ns, size):
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != mtime_ns or entry[1] != size:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, path, mtime_ns, size, value, cost=None):
+        key = os.path.abspath(path)
+        cost = size if cost is None else cost
+        with self._lock:
+            self._remove(key)
+            # 单个文档超过缓存上限时不缓存
+            if cost > self.max_bytes:
+                return
+            self._entries[key] = (mtime_ns, size, value, cost)
+            self.total_bytes += cost
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, _, evicted_cost) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_cost
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """删除文件或文件夹(包括其下所有文件)的缓存
+        """
+        key = os.path.abspath(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._remove(key)
+            for sub_key in [sub_key for sub_key in self._entries if sub_key.startswith(prefix)]:
+                self._remove(sub_key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[3]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits
+                , "misses": self.misses
+                , "evictions": self.evictions
+                , "entries": len(self._entries)
+                , "bytes": self.total_bytes
+                , "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+
+from server.apis.atomic_file import write_atomic
+
+# .ai文档顶层children的偏移索引
+# 保存JSON格式的文档时按 根节点 + 逐个顶层子节点 的顺序序列化，记录每个子节点在文件中的字节范围，
+# 分页读取时seek到对应位置读取，不需要解析整个文档
+# 索引文件内容: {"mtime_ns", "size", "ino", "revision": 文档版本, "head": 根节点(不含children)在文件开头占用的字节数, "children": [[start, end], ...]}
+# 文件的修改时间、大小或inode与索引不一致时(被其他程序修改)索引失效，原子替换后inode一定变化，同一时间内的两次保存也能区分
+# 索引文件名由文档路径决定，删除、重命名、移动文档时需要同步删除或改名(remove_indexes/move_indexes)
+
+def dumps_indexed(doc, dumps):
+    """序列化文档，返回(文档字节串, head, 子节点字节范围)
+    children不是数组时返回(None, None, None)，由调用方按普通方式序列化
+    """
+    children = doc.get("children")
+    if not isinstance(children, list):
+        return None, None, None
+    root = {key: value for key, value in doc.items() if key != "children"}
+    root_bytes = dumps(root)
+    head = len(root_bytes) - 1
+    parts = [root_bytes[:head], b',"children":[' if root else b'"children":[']
+    pos = sum(len(part) for part in parts)
+    offsets = []
+    for i, child in enumerate(children):
+        if i > 0:
+            parts.append(b',')
+            pos += 1
+        child_bytes = dumps(child)
+        parts.append(child_bytes)
+        offsets.append([pos, pos + len(child_bytes)])
+        pos += len(child_bytes)
+    parts.append(b']}')
+    return b''.join(parts), head, offsets
+
+def index_path(index_dir, path):
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode('utf8')).hexdigest()
+    return os.path.join(index_dir, key + '.json')
+
+def save_index(index_dir, path, st, revision, head, offsets):
+    """写入索引，st为文档写入后的os.stat结果，revision为写入内容的版本
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    index = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "ino": st.st_ino, "revision": revision, "head": head, "children": offsets}
+    write_atomic(index_path(index_dir, path), json.dumps(index).encode('utf8'))
+
+def load_index(index_dir, path, st):
+    """读取索引，不存在或与文件不一致时返回None
+    """
+    try:
+        with open(index_path(index_dir, path), 'r', encoding='utf8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("mtime_ns") != st.st_mtime_ns or index.get("size") != st.st_size or index.get("ino") != st.st_ino:
+        return None
+    # 旧版本的索引没有记录文档版本
+    if not index.get("revision"):
+        return None
+    return index
+
+def _iter_docs(path):
+    """文件或文件夹下所有的.ai文件
+    """
+    if os.path.isdir(path):
+        for folder, dirs, files in os.walk(path):
+            for name in files:
+                if name.endswith('.ai'):
+                    yield os.path.join(folder, name)
+    elif path.endswith('.ai'):
+        yield path
+
+def remove_indexes(index_dir, path, current_path=None):
+    """删除path(文件或文件夹)下所有文档的索引，需要在删除文件之前调用
+    current_path为文件当前所在的位置(如已移动到暂存目录)，默认为path
+    """
+    if not os.path.isdir(index_dir):
+        return
+    current_path = current_path or path
+    for doc_path in _iter_docs(current_path):
+        try:
+            os.remove(index_path(index_dir, path + doc_path[len(current_path):]))
+        except OSError:
+            pass
+
+def move_indexes(index_dir, path, new_path):
+    """重命名或移动后，把path下所有文档的索引改为new_path下对应路径的索引，需要在移动文件之后调用
+    移动不改变文件的修改时间和大小，索引仍然有效
+    """
+    if not os.path.isdir(index_dir):
+        return
+    for doc_path in _iter_docs(new_path):
+        try:
+            os.replace(index_path(index_dir, path + doc_path[len(new_path):]), index_path(index_dir, doc_path))
+        except OSError:
+            pass
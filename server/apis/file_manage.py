@@ -1,10 +1,29 @@
 import os, sys, argparse, stat
+import re
 import time
-import json
+import threading
+import tempfile
+import hashlib
+from contextlib import contextmanager
 from pydantic import BaseModel, Field, constr, parse_obj_as
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from typing import Dict, List, Optional
 import traceback
 from server.globalObject import global_obj
+from server.apis.md2aditor import ASSET_DIR_NAME
+from server.apis.search import get_search_index
+from server.apis.json_patch import apply_patch, JsonPatchError
+from server.apis.doc_cache import DocumentCache
+from server.apis.atomic_file import write_atomic
+import server.apis.doc_index as doc_index
+from server.apis.path_resolver import DEFAULT_OPEN_PATH, path_resolver
+import server.apis.ai_format as ai_format
+from server.apis.ai_format import json_dumps_bytes as _json_dumps_bytes
+import copy
+import shutil
+import uuid
+from collections import deque, OrderedDict
  
 # 模型管理
 class ParamsPath(BaseModel):
@@ -26,6 +45,8 @@ class ResponseFile(BaseModel):
     name: Optional[str] = Field(default="")
     path: Optional[str] = Field(default="")
     update_time: Optional[float] = Field(default=0)
+    # 文档版本(文件内容哈希)，/patch_file的base_revision
+    revision: Optional[str] = Field(default="")
     doc: Optional[Dict] = Field(default={})
     message: Optional[str] = Field(default="")
 
@@ -77,26 +98,100 @@ class ParamUpdateFile(BaseModel):
 class ResponseUpdateFile(BaseModel):
     status: bool
     message: Optional[str] = Field(default="")
+    update_time: Optional[float] = Field(default=0)
+    revision: Optional[str] = Field(default="")
+
+# 分页读取文档时每页默认返回的顶层子节点数
+DOC_PAGE_SIZE = 100
+
+class ParamsFilePage(BaseModel):
+    path: str
+    limit: Optional[int] = Field(default=DOC_PAGE_SIZE)
+
+class ResponseFilePage(BaseModel):
+    status: bool
+    type: Optional[str] = Field(default="")
+    name: Optional[str] = Field(default="")
+    path: Optional[str] = Field(default="")
+    update_time: Optional[float] = Field(default=0)
+    # 文档版本，读取后续页时作为base_revision
+    revision: Optional[str] = Field(default="")
+    # 根节点，children只包含第一页
+    doc: Optional[Dict] = Field(default={})
+    start: Optional[int] = Field(default=0)
+    total: Optional[int] = Field(default=0)
+    # 下一页的start，没有更多子节点时为None
+    cursor: Optional[int] = Field(default=None)
+    message: Optional[str] = Field(default="")
+
+class ParamsFileChildren(BaseModel):
+    path: str
+    start: int
+    limit: Optional[int] = Field(default=DOC_PAGE_SIZE)
+    # 第一页返回的revision, 文档已被修改时返回conflict
+    base_revision: Optional[str] = Field(default=None)
+
+class ResponseFileChildren(BaseModel):
+    status: bool
+    update_time: Optional[float] = Field(default=0)
+    revision: Optional[str] = Field(default="")
+    children: Optional[List] = Field(default=[])
+    start: Optional[int] = Field(default=0)
+    total: Optional[int] = Field(default=0)
+    cursor: Optional[int] = Field(default=None)
+    conflict: Optional[bool] = Field(default=False)
+    message: Optional[str] = Field(default="")
+
+# /tree默认遍历的层数
+TREE_DEFAULT_DEPTH = 3
+# /tree最多遍历的层数，<=0(不限制)或超过上限时按上限遍历
+TREE_MAX_DEPTH = 32
+
+class ParamsTree(BaseModel):
+    path: str
+    # 遍历的层数，1只返回当前目录，<=0时遍历到TREE_MAX_DEPTH层
+    depth: Optional[int] = Field(default=TREE_DEFAULT_DEPTH)
+
+class ResponseTree(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
 
-DEFAULT_OPEN_PATH = "所有笔记"
+class ParamBatch(BaseModel):
+    # 按顺序执行的操作，每项为{"op": 操作名, ...参数}
+    # delete: path; rename: path, name; move: path, dest(目标文件夹)
+    # new_folder: path, name; new_ai_file: path, name, version, egbenz_version
+    ops: List[Dict]
+    # 为True时任一操作失败则撤销所有已执行的操作
+    atomic: Optional[bool] = Field(default=False)
+
+class ResponseBatch(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    # 与ops一一对应的执行结果
+    results: Optional[List] = Field(default=[])
+
+class ResponseCacheStats(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    stats: Optional[Dict] = Field(default={})
+
+class ParamPatchFile(BaseModel):
+    path: str
+    # 客户端文档对应的版本, 即/file、/update_file、/patch_file返回的revision
+    base_revision: str
+    ops: List[Dict]
+
+class ResponsePatchFile(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    # base_revision不是最新版本时为True, 客户端需要重新获取文档
+    conflict: Optional[bool] = Field(default=False)
+    update_time: Optional[float] = Field(default=0)
+    revision: Optional[str] = Field(default="")
 
 def _path_fix(path):
-    # 如果path前缀存在如'所有笔记/'字符串，则去掉
-    if path.startswith(DEFAULT_OPEN_PATH + '/'):
-        path_arr = path.split('/')
-        path = os.path.join(*path_arr[1:])
-        # 如果是Linux，同时path首字母不是'/'开头
-        if sys.platform != "win32" and not path.startswith('/'):
-            path = '/' + path
-        # 如果工作目录存在，则拼接工作目录
-        path_prefix = global_obj.config.get('工作目录')
-        if path_prefix:
-            if os.path.exists(path_prefix):
-                # 如果path是'/'开头，则去掉
-                if path.startswith('/'):
-                    path = path[1:]
-                path = os.path.join(path_prefix, path)
-    return path
+    # 如果path前缀存在如'所有笔记/'字符串，则去掉，工作目录存在时拼接工作目录
+    return path_resolver.resolve(path)
 
 def _path_dirname(path):
     # 如果存在文件名去掉，只返回路径
@@ -104,6 +199,14 @@ def _path_dirname(path):
         return os.path.dirname(path)
     return path
 
+def _workspace_dir(name):
+    """工作目录下的数据目录(索引、资源库、暂存目录等)，未设置工作目录时位于当前目录
+    """
+    workspace = path_resolver.workspace()
+    if workspace:
+        return os.path.join(workspace, name)
+    return os.path.abspath(name)
+
 def _filename_rename(name):
     # 如果name不是.ai结尾返回false
     if not name.endswith('.ai'):
@@ -124,44 +227,268 @@ def file_is_hidden(path):
         else:
             return False
     else:
-        return path.startswith('.')
+        return os.path.basename(path).startswith('.')
 
-def _get_folder(path):
-    """获取文件夹下的所有文件和文件夹
+def _entry_is_hidden(entry):
+    """判断os.scandir返回的DirEntry是否是隐藏文件
+    windows下entry.stat()直接使用目录遍历时得到的属性，不会额外调用stat
+    """
+    if os.name == 'nt':
+        try:
+            file_attr = entry.stat().st_file_attributes
+        except:
+            return False
+        return bool(file_attr & stat.FILE_ATTRIBUTE_HIDDEN)
+    else:
+        return entry.name.startswith('.')
+
+# 文件夹列表缓存: 目录绝对路径 -> (目录修改时间, 文件列表)
+# 目录下新增、删除、重命名文件都会更新目录的修改时间, 修改时间不变时直接返回缓存
+# 超过FOLDER_CACHE_MAX_ENTRIES个目录时淘汰最久未使用的
+FOLDER_CACHE_MAX_ENTRIES = 4096
+_folder_cache = OrderedDict()
+_folder_cache_evictions = 0
+_folder_cache_lock = threading.Lock()
+
+def _invalidate_folder_cache(*paths):
+    """文件操作后清除相关目录的列表缓存
+    包括所在目录、自身以及(文件夹被删除或重命名时)其下的所有子目录，多个路径一次清除
+    """
+    keys = set()
+    sub_prefixes = []
+    for path in paths:
+        abs_path = os.path.abspath(path)
+        keys.add(os.path.dirname(abs_path))
+        keys.add(abs_path)
+        sub_prefixes.append(abs_path.rstrip(os.sep) + os.sep)
+    sub_prefixes = tuple(sub_prefixes)
+    with _folder_cache_lock:
+        for key in keys:
+            _folder_cache.pop(key, None)
+        if sub_prefixes:
+            for key in [key for key in _folder_cache if key.startswith(sub_prefixes)]:
+                _folder_cache.pop(key, None)
+
+def _scan_folder(path):
+    """使用os.scandir遍历文件夹, 文件类型和修改时间使用DirEntry缓存的信息
     """
     result = []
-    for file in os.listdir(path):
-        if file_is_hidden(os.path.join(path,file)):
-            continue
-        # 获取文件或文件夹的完整路径
-        file_path = os.path.join(path, file)
-        # 获取文件或文件夹的最后修改时间
-        update_time = time.localtime(os.path.getmtime(file_path))
-        # 将时间转换为字符串格式
-        update_time_str = time.strftime('%Y-%m-%d %H:%M:%S', update_time)
-        # 根据路径是一个文件还是文件夹来判断
-        if os.path.isfile(file_path):
-            file_type = 'file'
-        else:
-            file_type = 'folder'
-        file_abs_path = os.path.abspath(file_path)
-        # 构造结果字典
-        file_info = dict(name=file, update_time=update_time_str, type=file_type, path=file_abs_path)
-        # 将文件信息添加到结果列表
-        result.append(file_info)
+    abs_dir = os.path.abspath(path)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if _entry_is_hidden(entry):
+                continue
+            try:
+                # 获取文件或文件夹的最后修改时间
+                update_time = time.localtime(entry.stat().st_mtime)
+                # 根据路径是一个文件还是文件夹来判断
+                file_type = 'file' if entry.is_file() else 'folder'
+            except OSError:
+                # 失效的链接等无法获取信息的文件直接跳过
+                continue
+            # 将时间转换为字符串格式
+            update_time_str = time.strftime('%Y-%m-%d %H:%M:%S', update_time)
+            # 构造结果字典
+            file_info = dict(name=entry.name, update_time=update_time_str, type=file_type, path=os.path.join(abs_dir, entry.name))
+            # 将文件信息添加到结果列表
+            result.append(file_info)
 
     result.sort(key=lambda x: (1 if x['type']=='file' else 0, x['name']))
     return result
 
+def _get_folder(path):
+    """获取文件夹下的所有文件和文件夹
+    """
+    abs_path = os.path.abspath(path)
+    dir_mtime = os.stat(abs_path).st_mtime_ns
+    with _folder_cache_lock:
+        cached = _folder_cache.get(abs_path)
+        if cached is not None and cached[0] == dir_mtime:
+            _folder_cache.move_to_end(abs_path)
+            return list(cached[1])
+
+    result = _scan_folder(abs_path)
+    global _folder_cache_evictions
+    with _folder_cache_lock:
+        _folder_cache[abs_path] = (dir_mtime, result)
+        _folder_cache.move_to_end(abs_path)
+        while len(_folder_cache) > FOLDER_CACHE_MAX_ENTRIES:
+            _folder_cache.popitem(last=False)
+            _folder_cache_evictions += 1
+    return list(result)
+
+# 同一文件的保存串行执行: 文件绝对路径 -> [锁, 等待/持有锁的请求数]
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+@contextmanager
+def _path_lock(path):
+    """按文件路径加锁，没有请求使用时释放锁对象
+    """
+    key = os.path.normcase(os.path.abspath(path))
+    with _path_locks_lock:
+        entry = _path_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _path_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _path_locks.pop(key, None)
+
+def _storage_format(path):
+    """保存文档使用的格式: 已存在的文件保持原格式，新文件使用配置中的格式
+    """
+    fmt = ai_format.sniff_file(path)
+    if fmt is None:
+        fmt = global_obj.config.get('AI Storage Format') or ai_format.FORMAT_JSON
+    return ai_format.available_format(fmt)
+
+def _revision(data):
+    """文档版本: 文件内容的哈希
+    文件修改时间的精度可能只有秒级(如FAT为2秒)，同一时间内的两次保存只能通过内容区分
+    """
+    return hashlib.sha1(data).hexdigest()
+
+def _write_doc_atomic(path, doc, fmt=None):
+    """先写入同目录下的临时文件并fsync，再用os.replace替换目标文件
+    写入过程中崩溃不会留下被截断的文档，返回写入内容的版本(见_revision)
+    """
+    fmt = fmt or _storage_format(path)
+    data = head = offsets = None
+    if fmt == ai_format.FORMAT_JSON:
+        # JSON格式同时生成顶层children的偏移索引，用于分页读取
+        data, head, offsets = doc_index.dumps_indexed(doc, _json_dumps_bytes)
+    if data is None:
+        data = ai_format.dumps(doc, fmt)
+    write_atomic(path, data)
+    revision = _revision(data)
+    if offsets is not None:
+        try:
+            doc_index.save_index(_workspace_dir(DOC_INDEX_DIR_NAME), path, os.stat(path), revision, head, offsets)
+        except Exception:
+            # 索引只用于加速分页读取，写入失败不影响保存
+            traceback.print_exc()
+    else:
+        # 改为compact格式保存时，原来JSON格式的索引已经无效
+        _remove_doc_index(path)
+    return revision
+
+# 文档偏移索引目录，位于工作目录下
+DOC_INDEX_DIR_NAME = '.egbenz_index'
+
+def _remove_doc_index(path, current_path=None):
+    """删除文件或文件夹前删除其下文档的偏移索引，失败不影响文件操作
+    """
+    try:
+        doc_index.remove_indexes(_workspace_dir(DOC_INDEX_DIR_NAME), path, current_path)
+    except Exception:
+        traceback.print_exc()
+
+def _move_doc_index(path, new_path):
+    """重命名或移动后同步偏移索引，失败不影响文件操作
+    """
+    try:
+        doc_index.move_indexes(_workspace_dir(DOC_INDEX_DIR_NAME), path, new_path)
+    except Exception:
+        traceback.print_exc()
+
+# .ai文档缓存，/file、/patch_file和分页读取共用
+DOC_CACHE_MAX_BYTES = 256 * 1024 * 1024
+_doc_cache = DocumentCache(DOC_CACHE_MAX_BYTES)
+
+class _CachedDoc:
+    """文档缓存条目: doc为解析后的文档，raw为校验过的JSON字节(/file直接返回)，两者按需生成
+    revision为文档版本，size为文档解码后的字节数(见ai_format.decoded_size)，用于估算doc的内存占用
+    """
+    __slots__ = ("doc", "raw", "revision", "size")
+
+    def __init__(self, revision, doc=None, raw=None, size=0):
+        self.revision = revision
+        self.doc = doc
+        self.raw = raw
+        self.size = size
+
+    def cost(self):
+        return (self.size if self.doc is not None else 0) + (len(self.raw) if self.raw is not None else 0)
+
+def _cache_put(path, st, entry):
+    _doc_cache.put(path, st.st_mtime_ns, st.st_size, entry, entry.cost())
+
+def _read_doc_file(path):
+    """读取文件内容，返回(内容, os.stat结果)
+    使用打开后的文件信息，保证缓存的版本和读取的内容一致
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        return f.read(), st
+
+def _load_entry(path):
+    """读取.ai文档，文件未修改时直接使用缓存，返回(缓存条目, os.stat结果)
+    缓存中的文档会被多个请求共享，调用方不能修改
+    """
+    st = os.stat(path)
+    entry = _doc_cache.get(path, st.st_mtime_ns, st.st_size)
+    if entry is not None and entry.doc is not None:
+        return entry, st
+    if entry is not None:
+        # 只缓存了JSON字节，直接解析，不需要再读取文件
+        entry = _CachedDoc(entry.revision, ai_format.json_loads(entry.raw), entry.raw, entry.size)
+    else:
+        data, st = _read_doc_file(path)
+        entry = _CachedDoc(_revision(data), ai_format.loads(data), size=ai_format.decoded_size(data, len(data)))
+    _cache_put(path, st, entry)
+    return entry, st
+
+def _load_raw(path):
+    """读取文档的JSON字节，返回(缓存条目, os.stat结果)，/file用于compact格式的文档
+    缓存未命中时完整解析一次，损坏的文档抛出异常；compact格式转换为JSON
+    """
+    st = os.stat(path)
+    entry = _doc_cache.get(path, st.st_mtime_ns, st.st_size)
+    if entry is not None and entry.raw is not None:
+        return entry, st
+    if entry is not None:
+        entry = _CachedDoc(entry.revision, entry.doc, _json_dumps_bytes(entry.doc), entry.size)
+    else:
+        data, st = _read_doc_file(path)
+        doc = ai_format.loads(data)
+        if not isinstance(doc, dict):
+            raise ValueError("文档不是JSON对象")
+        # 校验后只缓存JSON字节，需要文档时再解析
+        entry = _CachedDoc(_revision(data), raw=_json_dumps_bytes(doc) if ai_format.is_compact(data) else data, size=ai_format.decoded_size(data, len(data)))
+    _cache_put(path, st, entry)
+    return entry, st
+
+def _cache_saved_doc(path, doc, revision):
+    """保存文档后放入缓存，revision为_write_doc_atomic的返回值，返回新的修改时间
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        size = ai_format.decoded_size(f.read(ai_format.SIZE_HEAD_BYTES), st.st_size)
+    _cache_put(path, st, _CachedDoc(revision, doc, size=size))
+    return st.st_mtime
+
+def _update_search_index(action, *args):
+    """文件变化时提交到后台线程更新全文索引，不阻塞文件操作，索引失败不影响文件操作
+    """
+    search_index = get_search_index()
+    if search_index is None:
+        return
+    try:
+        search_index.submit(action, *args)
+    except Exception:
+        traceback.print_exc()
+
 def _get_root_path():
     """获取windows/linux系统的根目录下文件
     """
-    config = global_obj.config.get_all()
     # 如果config['工作目录']存在，则返回config['工作目录']下的文件
-    if '工作目录' in config:
-        path = config['工作目录']
-        if os.path.exists(path):
-            return _get_folder(path)
+    workspace = path_resolver.workspace()
+    if workspace:
+        return _get_folder(workspace)
 
     result = []
     if sys.platform == "win32":
@@ -194,6 +521,63 @@ def get_all_files(params: ParamsPath):
     else:
         return parse_obj_as(ResponsePath, {"status":False, "message": f"'{path}'不存在"})
 
+# /tree每次输出的最大行数，文件很多的目录分多次输出
+TREE_CHUNK_ENTRIES = 1000
+
+def _iter_tree(path, depth):
+    """广度优先遍历目录，输出NDJSON，每行一个文件或文件夹，额外包含parent(所在目录)和depth(层级)
+    目录的真实路径只访问一次，避免符号链接形成循环
+    """
+    visited = set()
+    queue = deque([(path, 1)])
+    while queue:
+        folder, level = queue.popleft()
+        if folder == DEFAULT_OPEN_PATH:
+            files = _get_root_path()
+            # 根目录列表是工作目录下的文件时，工作目录同样只访问一次
+            workspace = path_resolver.workspace()
+            if workspace:
+                visited.add(os.path.realpath(workspace))
+        else:
+            real_path = os.path.realpath(folder)
+            if real_path in visited:
+                continue
+            visited.add(real_path)
+            try:
+                files = _get_folder(folder)
+            except OSError:
+                # 没有权限或遍历时已被删除的目录直接跳过
+                continue
+        for i in range(0, len(files), TREE_CHUNK_ENTRIES):
+            yield b''.join(_json_dumps_bytes(dict(file, parent=folder, depth=level)) + b'\n' for file in files[i:i + TREE_CHUNK_ENTRIES])
+        if level < depth:
+            queue.extend((file["path"], level + 1) for file in files if file["type"] == "folder")
+
+def _prepare_tree(params: ParamsTree):
+    """返回(起始目录, 遍历层数, 错误响应)
+    """
+    depth = params.depth or 0
+    if params.path == DEFAULT_OPEN_PATH:
+        # 没有工作目录时所有笔记是整个文件系统的根目录，不允许不限层数遍历
+        if depth <= 0 and not path_resolver.workspace():
+            return None, None, parse_obj_as(ResponseTree, {"status":False, "message": "未设置工作目录时不能不限层数遍历所有笔记"})
+        path = DEFAULT_OPEN_PATH
+    else:
+        path = _path_dirname(_path_fix(params.path))
+        if not os.path.isdir(path):
+            return None, None, parse_obj_as(ResponseTree, {"status":False, "message": f"'{path}'不存在"})
+    if depth <= 0 or depth > TREE_MAX_DEPTH:
+        depth = TREE_MAX_DEPTH
+    return path, depth, None
+
+def get_tree(params: ParamsTree):
+    """一次返回多层目录结构，边遍历边输出
+    """
+    path, depth, error = _prepare_tree(params)
+    if error is not None:
+        return error
+    return StreamingResponse(_iter_tree(path, depth), media_type="application/x-ndjson")
+
 def get_folders(params: ParamFolders):
     result = []
     try:
@@ -225,24 +609,24 @@ def get_file(params: ParamsFile):
         # 获取文件后缀名
         file_ext = os.path.splitext(path)[-1]
         if file_ext == '.ai':
-            with open(path, 'r', encoding='utf8') as f:
-                try:
-                    file_json = json.load(f)
-                    return parse_obj_as(ResponseFile, {
-                        "status":True
-                        , "type":"file"
-                        , "name": os.path.basename(f.name)
-                        , "path": params.path
-                        , "update_time": os.path.getmtime(f.name)
-                        , "doc": file_json
-                    })
-                except Exception as e:
-                    print(traceback.format_exc())
-                    return parse_obj_as(ResponseFile, {
-                        "status":False
-                        , "type": "unknow"
-                        , "message": "文件格式不正确"
-                    })
+            try:
+                entry, st = _load_entry(path)
+                return parse_obj_as(ResponseFile, {
+                    "status":True
+                    , "type":"file"
+                    , "name": os.path.basename(path)
+                    , "path": params.path
+                    , "update_time": st.st_mtime
+                    , "revision": entry.revision
+                    , "doc": entry.doc
+                })
+            except Exception as e:
+                print(traceback.format_exc())
+                return parse_obj_as(ResponseFile, {
+                    "status":False
+                    , "type": "unknow"
+                    , "message": "文件格式不正确"
+                })
         else:
             return parse_obj_as(ResponseFile, {
                 "status":False
@@ -256,6 +640,236 @@ def get_file(params: ParamsFile):
             , "message": "文件不存在"
         })
 
+# /file流式返回JSON文档时每次读取的字节数，小于RAW_STREAM_THRESHOLD的文档一次性返回
+RAW_CHUNK_SIZE = 256 * 1024
+RAW_STREAM_THRESHOLD = 1024 * 1024
+# 检查JSON文档是否完整时读取的文件末尾字节数
+RAW_TAIL_BYTES = 64
+
+def _json_complete(f, st, head):
+    """粗略检查JSON文档是否完整: 以'{'开头、以'}'结尾，截断的文档交给get_file返回错误
+    """
+    if not head.lstrip().startswith(b'{'):
+        return False
+    f.seek(max(0, st.st_size - RAW_TAIL_BYTES))
+    return f.read().rstrip().endswith(b'}')
+
+def _json_revision(path, f, st):
+    """JSON文档的版本: 优先使用文档缓存中的版本，否则按块计算文件内容的哈希，内存占用与文档大小无关
+    """
+    entry = _doc_cache.get(path, st.st_mtime_ns, st.st_size)
+    if entry is not None:
+        return entry.revision
+    digest = hashlib.sha1()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(RAW_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def _iter_raw(f, prefix):
+    try:
+        yield prefix
+        f.seek(0)
+        for chunk in iter(lambda: f.read(RAW_CHUNK_SIZE), b''):
+            yield chunk
+        yield b'}'
+    finally:
+        f.close()
+
+def _prepare_file_raw(params: ParamsFile):
+    """返回(响应, 响应体生成器, 响应体长度)，生成器不为None时需要流式返回
+    """
+    path = _path_fix(params.path)
+    if not os.path.isfile(path) or os.path.splitext(path)[-1] != '.ai':
+        return get_file(params), None, 0
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return get_file(params), None, 0
+
+    try:
+        # 使用打开后的文件信息，文件被替换时仍返回同一版本的内容
+        st = os.fstat(f.fileno())
+        head = f.read(ai_format.HEADER_SIZE)
+        if ai_format.is_compact(head):
+            f.close()
+            return _get_file_compact(params, path), None, 0
+        if not _json_complete(f, st, head):
+            f.close()
+            return get_file(params), None, 0
+        # 去掉结尾的'}'，接上doc字段
+        envelope = _json_dumps_bytes({
+            "status": True
+            , "type": "file"
+            , "name": os.path.basename(path)
+            , "path": params.path
+            , "update_time": st.st_mtime
+            , "revision": _json_revision(path, f, st)
+            , "message": ""
+        })
+        prefix = envelope[:-1] + b',"doc":'
+        if st.st_size <= RAW_STREAM_THRESHOLD:
+            f.seek(0)
+            body = prefix + f.read() + b'}'
+            f.close()
+            return Response(content=body, media_type="application/json"), None, 0
+    except BaseException:
+        f.close()
+        raise
+    return None, _iter_raw(f, prefix), len(prefix) + st.st_size + 1
+
+def _get_file_compact(params: ParamsFile, path):
+    """compact格式的文档解码后转换为JSON字节，放入文档缓存
+    """
+    try:
+        entry, st = _load_raw(path)
+    except Exception:
+        return get_file(params)
+    envelope = _json_dumps_bytes({
+        "status": True
+        , "type": "file"
+        , "name": os.path.basename(path)
+        , "path": params.path
+        , "update_time": st.st_mtime
+        , "revision": entry.revision
+        , "message": ""
+    })
+    return Response(content=envelope[:-1] + b',"doc":' + entry.raw + b'}', media_type="application/json")
+
+def get_file_raw(params: ParamsFile):
+    """/file的快速路径: 把文档的JSON字节直接拼接到响应的doc字段，不经过pydantic校验和再次序列化
+    JSON格式直接返回文件内容，不解析文档，大文档分块流式返回；compact格式解码一次后缓存JSON字节
+    文件不存在、不是.ai或内容不完整时交给get_file处理
+    """
+    response, iterator, content_length = _prepare_file_raw(params)
+    if iterator is None:
+        return response
+    return StreamingResponse(iterator, media_type="application/json", headers={"Content-Length": str(content_length)})
+
+def _read_page(path, start, limit):
+    """读取根节点(不含children)和children[start:start+limit]，返回(修改时间, 文档版本, 根节点, 子节点, 子节点总数)
+    根节点为JSON字节串，子节点为逗号分隔的JSON字节串；有偏移索引时只读取需要的字节范围，否则解析整个文档
+    """
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        index = doc_index.load_index(_workspace_dir(DOC_INDEX_DIR_NAME), path, st)
+        if index is not None:
+            offsets = index["children"]
+            root_bytes = f.read(index["head"]) + b'}'
+            page = offsets[start:start + limit]
+            children_bytes = b''
+            if page:
+                f.seek(page[0][0])
+                children_bytes = f.read(page[-1][1] - page[0][0])
+            return st.st_mtime, index["revision"], root_bytes, children_bytes, len(offsets)
+
+    entry, st = _load_entry(path)
+    doc = entry.doc
+    children = doc.get("children")
+    if not isinstance(children, list):
+        children = []
+    root_bytes = _json_dumps_bytes({key: value for key, value in doc.items() if key != "children"})
+    children_bytes = b','.join(_json_dumps_bytes(child) for child in children[start:start + limit])
+    return st.st_mtime, entry.revision, root_bytes, children_bytes, len(children)
+
+def _check_ai_file(path):
+    """返回错误信息，文件可以打开时返回None
+    """
+    if not os.path.isfile(path):
+        return "文件不存在"
+    if os.path.splitext(path)[-1] != '.ai':
+        return "不能打开.ai以外的文件"
+    return None
+
+def get_file_page(params: ParamsFilePage):
+    """分页读取文档: 返回根节点和第一页顶层子节点，其余子节点通过/file_children获取
+    """
+    path = _path_fix(params.path)
+    message = _check_ai_file(path)
+    if message:
+        return parse_obj_as(ResponseFilePage, {"status":False, "type": "unknow", "message": message})
+    limit = max(params.limit or DOC_PAGE_SIZE, 1)
+    try:
+        update_time, revision, root_bytes, children_bytes, total = _read_page(path, 0, limit)
+    except Exception:
+        print(traceback.format_exc())
+        return parse_obj_as(ResponseFilePage, {"status":False, "type": "unknow", "message": "文件格式不正确"})
+
+    envelope = _json_dumps_bytes({
+        "status": True
+        , "type": "file"
+        , "name": os.path.basename(path)
+        , "path": params.path
+        , "update_time": update_time
+        , "revision": revision
+        , "start": 0
+        , "total": total
+        , "cursor": limit if limit < total else None
+        , "message": ""
+    })
+    # 根节点去掉结尾的'}'，接上第一页children
+    doc = root_bytes[:-1] + (b',' if len(root_bytes) > 2 else b'') + b'"children":[' + children_bytes + b']}'
+    return Response(content=envelope[:-1] + b',"doc":' + doc + b'}', media_type="application/json")
+
+def get_file_children(params: ParamsFileChildren):
+    """按下标范围读取文档的顶层子节点
+    """
+    path = _path_fix(params.path)
+    message = _check_ai_file(path)
+    if message:
+        return parse_obj_as(ResponseFileChildren, {"status":False, "message": message})
+    start = max(params.start, 0)
+    limit = max(params.limit or DOC_PAGE_SIZE, 1)
+    try:
+        update_time, revision, _, children_bytes, total = _read_page(path, start, limit)
+    except Exception:
+        print(traceback.format_exc())
+        return parse_obj_as(ResponseFileChildren, {"status":False, "message": "文件格式不正确"})
+    if params.base_revision is not None and params.base_revision != revision:
+        return parse_obj_as(ResponseFileChildren, {"status":False, "conflict":True, "update_time": update_time, "revision": revision, "message":"文档已被修改，请重新加载"})
+
+    envelope = _json_dumps_bytes({
+        "status": True
+        , "update_time": update_time
+        , "revision": revision
+        , "start": start
+        , "total": total
+        , "cursor": start + limit if start + limit < total else None
+        , "conflict": False
+        , "message": ""
+    })
+    return Response(content=envelope[:-1] + b',"children":[' + children_bytes + b']}', media_type="application/json")
+
+def _new_ai_doc(version, egbenz_version):
+    """新建.ai文件的默认内容
+    """
+    return {
+        "name": "aditor",
+        "type": "child",
+        "style": {},
+        "data": {
+            "version": version,
+            "egbenz_version": egbenz_version
+        },
+        "children": [
+            {
+                "name": "aditorParagraph",
+                "type": "child",
+                "style": {},
+                "data": {},
+                "children": [{
+                    "name": "aditorText",
+                    "type": "leaf",
+                    "style": {},
+                    "data": {
+                        "text": ""
+                    },
+                    "children": []
+                }]
+            }
+        ]
+    }
+
 def new_ai_file(params: ParamsNewFile):
     """创建一个.ai文件
     """
@@ -267,32 +881,7 @@ def new_ai_file(params: ParamsNewFile):
         return parse_obj_as(ResponseNewFile, {"status":False, "message":"创建失败,文件名不是以.ai结尾的文件"})
 
     # 创建新的json文件内容
-    new_ai = {
-    "name": "aditor",
-    "type": "child",
-    "style": {},
-    "data": {
-        "version": version,
-        "egbenz_version": egbenz_version
-    },
-    "children": [
-        {
-            "name": "aditorParagraph",
-            "type": "child",
-            "style": {},
-            "data": {},
-            "children": [{
-                "name": "aditorText",
-                "type": "leaf",
-                "style": {},
-                "data": {
-                    "text": ""
-                },
-                "children": []
-            }]
-        }
-    ]
-}
+    new_ai = _new_ai_doc(version, egbenz_version)
 
     # 创建目标文件路径
     target_path = os.path.join(path, name)
@@ -300,8 +889,13 @@ def new_ai_file(params: ParamsNewFile):
         return parse_obj_as(ResponseNewFile, {"status":False, "message":"创建失败,文件已存在"})
     
     # 将新文件内容保存到指定文件路径
-    with open(target_path, "w") as f:
-        json.dump(new_ai, f)
+    with _path_lock(target_path):
+        if os.path.exists(target_path):
+            return parse_obj_as(ResponseNewFile, {"status":False, "message":"创建失败,文件已存在"})
+        revision = _write_doc_atomic(target_path, new_ai)
+        _cache_saved_doc(target_path, new_ai, revision)
+        _invalidate_folder_cache(target_path)
+        _update_search_index('update_file', target_path, new_ai)
 
     return parse_obj_as(ResponseNewFile, {"status":True, "message":"创建文件成功"})
 
@@ -311,17 +905,24 @@ def new_folder(params: ParamsNewFolder):
         return parse_obj_as(ResponseNewFolder, {"status":False, "message":"创建失败,文件夹已存在"})
     
     os.makedirs(new_folder)
+    _invalidate_folder_cache(new_folder)
     return parse_obj_as(ResponseNewFolder, {"status":True, "message":"创建文件夹成功"})
 
+def _remove_path(path):
+    if os.path.isfile(path):
+        os.remove(path)
+    else:
+        # 强制删除，即使目录不为空
+        shutil.rmtree(path, ignore_errors=True)
+
 def delete_path(params: ParamsDelete):
     path = _path_fix(params.path)
     if os.path.exists(path):
-        if os.path.isfile(path):
-            os.remove(path)
-        else:
-            # 强制删除，即使目录不为空
-            import shutil
-            shutil.rmtree(path, ignore_errors=True)
+        _remove_doc_index(path)
+        _remove_path(path)
+        _invalidate_folder_cache(path)
+        _doc_cache.invalidate(path)
+        _update_search_index('delete_path', path)
         return parse_obj_as(ResponseDeletePath, {"status":True, "message":"删除成功"})
     else:
         return parse_obj_as(ResponseDeletePath, {"status":False, "message":"删除失败,文件不存在"})
@@ -335,6 +936,12 @@ def rename_path(params: ParamRename):
         return parse_obj_as(ResponseRenamePath, {"status":False, "message":"重命名失败,文件已存在"})
 
     os.rename(path, new_path)
+    _move_doc_index(path, new_path)
+    _invalidate_folder_cache(path)
+    _invalidate_folder_cache(new_path)
+    _doc_cache.invalidate(path)
+    _doc_cache.invalidate(new_path)
+    _update_search_index('rename_path', path, new_path)
     return parse_obj_as(ResponseRenamePath, {"status":True, "message":"重命名成功"})
 
 def update_file(params: ParamUpdateFile):
@@ -345,18 +952,245 @@ def update_file(params: ParamUpdateFile):
     if not path.endswith('.ai'):
         return parse_obj_as(ResponseUpdateFile, {"status":False, "message":"创建失败，不是.ai结尾的文档"})
 
-    # 如果文档不存在，则创建
+    # 文档不存在则创建，存在则更新；同一文档的多次保存依次执行
+    with _path_lock(path):
+        revision = _write_doc_atomic(path, doc)
+        update_time = _cache_saved_doc(path, doc, revision)
+        # 修改文件内容不会更新目录的修改时间，需要主动清除缓存以刷新列表中的修改时间
+        _invalidate_folder_cache(path)
+        _update_search_index('update_file', path, doc)
+    return parse_obj_as(ResponseUpdateFile, {"status":True, "message":"保存文件成功", "update_time": update_time, "revision": revision})
+
+def patch_file(params: ParamPatchFile):
+    """按JSON Patch增量保存文档
+    base_revision与文档当前版本不一致时返回conflict，客户端需要重新获取文档
+    """
+    path = _path_fix(params.path)
+    if not path.endswith('.ai'):
+        return parse_obj_as(ResponsePatchFile, {"status":False, "message":"保存失败，不是.ai结尾的文档"})
+
+    with _path_lock(path):
+        if not os.path.isfile(path):
+            return parse_obj_as(ResponsePatchFile, {"status":False, "message":"保存失败,文件不存在"})
+        entry, st = _load_entry(path)
+        if entry.revision != params.base_revision:
+            return parse_obj_as(ResponsePatchFile, {"status":False, "conflict":True, "update_time": st.st_mtime, "revision": entry.revision, "message":"文档已被修改，请重新加载"})
+
+        # 缓存中的文档可能正在被其他请求返回，复制后再修改
+        doc = copy.deepcopy(entry.doc)
+        try:
+            apply_patch(doc, params.ops)
+        except JsonPatchError as e:
+            return parse_obj_as(ResponsePatchFile, {"status":False, "update_time": st.st_mtime, "revision": entry.revision, "message": f"保存失败:{e}"})
+
+        revision = _write_doc_atomic(path, doc)
+        update_time = _cache_saved_doc(path, doc, revision)
+        _invalidate_folder_cache(path)
+        _update_search_index('update_file', path, doc)
+    return parse_obj_as(ResponsePatchFile, {"status":True, "message":"保存文件成功", "update_time": update_time, "revision": revision})
+
+# 图片资源库中的文件名: 内容哈希 + 图片后缀
+ASSET_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.(png|jpg|jpeg|gif|bmp)$')
+# 文件名即内容哈希，内容不会变化，浏览器可以长期缓存
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def get_asset(name: str):
+    """读取引用模式导入的图片
+    """
+    if not ASSET_NAME_PATTERN.match(name):
+        raise HTTPException(status_code=404, detail="资源不存在")
+    path = os.path.join(_workspace_dir(ASSET_DIR_NAME), name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="资源不存在")
+    return FileResponse(path, headers={"Cache-Control": ASSET_CACHE_CONTROL})
+
+def get_cache_stats():
+    """文档缓存和文件夹列表缓存的统计信息
+    """
+    stats = {"documents": _doc_cache.stats()}
+    with _folder_cache_lock:
+        stats["folders"] = {"entries": len(_folder_cache), "max_entries": FOLDER_CACHE_MAX_ENTRIES, "evictions": _folder_cache_evictions}
+    return parse_obj_as(ResponseCacheStats, {"status":True, "stats": stats})
+
+class _BatchError(Exception):
+    pass
+
+def _batch_arg(op, key):
+    value = op.get(key)
+    if not isinstance(value, str) or not value:
+        raise _BatchError(f"缺少参数{key}")
+    return value
+
+# 批量操作的实现: 执行操作，返回(撤销函数, 提交函数, 变化的路径)
+# 提交函数在操作生效后更新文档缓存和全文索引；atomic模式下所有操作成功后才提交
+def _batch_delete(op, fix, staging):
+    path = fix(_batch_arg(op, "path"))
     if not os.path.exists(path):
-        with open(path, 'w') as f:
-            json.dump(doc, f)
+        raise _BatchError("删除失败,文件不存在")
 
-        return parse_obj_as(ResponseUpdateFile, {"status":True, "message":"保存文件成功"})
+    def commit():
+        _doc_cache.invalidate(path)
+        _update_search_index('delete_path', path)
+    if staging is None:
+        _remove_doc_index(path)
+        _remove_path(path)
+        return None, commit, [path]
 
-    # 如果文档存在则更新文档
-    with open(path, 'w') as f:
-        json.dump(doc, f)
-    return parse_obj_as(ResponseUpdateFile, {"status":True, "message":"保存文件成功"})
+    # 先移动到暂存目录，提交时再删除
+    staged_path = os.path.join(staging, uuid.uuid4().hex)
+    os.rename(path, staged_path)
+    def commit_staged():
+        _remove_doc_index(path, staged_path)
+        _remove_path(staged_path)
+        commit()
+    return lambda: os.rename(staged_path, path), commit_staged, [path]
 
+def _batch_move_path(path, new_path):
+    if not os.path.exists(path):
+        raise _BatchError("文件不存在")
+    if os.path.exists(new_path):
+        raise _BatchError("文件已存在")
+    os.rename(path, new_path)
+
+    def commit():
+        _move_doc_index(path, new_path)
+        _doc_cache.invalidate(path)
+        _doc_cache.invalidate(new_path)
+        _update_search_index('rename_path', path, new_path)
+    return lambda: os.rename(new_path, path), commit, [path, new_path]
+
+def _batch_rename(op, fix, staging):
+    path = fix(_batch_arg(op, "path"))
+    return _batch_move_path(path, os.path.join(os.path.dirname(path), _batch_arg(op, "name")))
+
+def _batch_move(op, fix, staging):
+    path = os.path.abspath(fix(_batch_arg(op, "path")))
+    dest = os.path.abspath(_path_dirname(fix(_batch_arg(op, "dest"))))
+    if not os.path.isdir(dest):
+        raise _BatchError("目标文件夹不存在")
+    # 不能移动到自身或自身的子目录中
+    if (dest + os.sep).startswith(path.rstrip(os.sep) + os.sep):
+        raise _BatchError("不能移动到自身的子目录")
+    return _batch_move_path(path, os.path.join(dest, os.path.basename(path)))
+
+def _batch_new_folder(op, fix, staging):
+    path = os.path.join(_path_dirname(fix(_batch_arg(op, "path"))), _batch_arg(op, "name"))
+    if os.path.exists(path):
+        raise _BatchError("创建失败,文件夹已存在")
+    # 撤销时删除本次创建的最上层目录
+    top = os.path.abspath(path)
+    while not os.path.exists(os.path.dirname(top)) and os.path.dirname(top) != top:
+        top = os.path.dirname(top)
+    os.makedirs(path)
+    return lambda: shutil.rmtree(top), lambda: None, [top]
+
+def _batch_new_ai_file(op, fix, staging):
+    name = _batch_arg(op, "name")
+    if not _filename_rename(name):
+        raise _BatchError("创建失败,文件名不是以.ai结尾的文件")
+    target_path = os.path.join(_path_dirname(fix(_batch_arg(op, "path"))), name)
+    doc = _new_ai_doc(op.get("version") or "0.0.1", op.get("egbenz_version") or "0.0.1")
+    with _path_lock(target_path):
+        if os.path.exists(target_path):
+            raise _BatchError("创建失败,文件已存在")
+        revision = _write_doc_atomic(target_path, doc)
 
+    def undo():
+        _remove_doc_index(target_path)
+        os.remove(target_path)
+
+    def commit():
+        _cache_saved_doc(target_path, doc, revision)
+        _update_search_index('update_file', target_path, doc)
+    return undo, commit, [target_path]
+
+_BATCH_OPS = {
+    "delete": _batch_delete
+    , "rename": _batch_rename
+    , "move": _batch_move
+    , "new_folder": _batch_new_folder
+    , "new_ai_file": _batch_new_ai_file
+}
 
+# atomic批量操作的暂存目录，位于工作目录下
+# 删除的文件需要rename到暂存目录，和工作目录不在同一磁盘时删除会失败
+BATCH_STAGING_DIR_NAME = '.egbenz_staging'
+
+def batch(params: ParamBatch):
+    """按顺序执行多个文件操作，结束后一次清除目录缓存
+    atomic为True时删除的文件先移动到暂存目录，任一操作失败则逆序撤销已执行的操作
+    """
+    # 路径解析使用path_resolver的缓存，相同路径只解析一次
+    fix = _path_fix
+
+    staging = None
+    if params.atomic:
+        staging_root = _workspace_dir(BATCH_STAGING_DIR_NAME)
+        os.makedirs(staging_root, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=staging_root)
+
+    results = []
+    undo_log = []
+    commits = []
+    changed = []
+    failed = False
+    # 暂存目录只在提交或撤销全部成功后删除，否则保留其中的文件以便手动恢复
+    remove_staging = not params.atomic
+    try:
+        for op in params.ops:
+            result = {"op": op.get("op"), "path": op.get("path"), "status": True, "message": "成功"}
+            results.append(result)
+            try:
+                handler = _BATCH_OPS.get(op.get("op"))
+                if handler is None:
+                    raise _BatchError(f"不支持的操作: {op.get('op')}")
+                undo, commit, paths = handler(op, fix, staging)
+            except _BatchError as e:
+                result.update(status=False, message=str(e))
+            except OSError as e:
+                result.update(status=False, message=f"操作失败:{e}")
+            except Exception as e:
+                traceback.print_exc()
+                result.update(status=False, message=f"操作失败:{e}")
+            if not result["status"]:
+                if params.atomic:
+                    failed = True
+                    break
+                continue
+
+            changed.extend(paths)
+            if params.atomic:
+                undo_log.append((result, undo))
+                commits.append(commit)
+            else:
+                commit()
+
+        if failed:
+            remove_staging = True
+            for result, undo in reversed(undo_log):
+                try:
+                    undo()
+                    result.update(status=False, message="已撤销")
+                except Exception as e:
+                    traceback.print_exc()
+                    remove_staging = False
+                    result.update(status=False, message=f"撤销失败:{e}")
+            if not remove_staging:
+                print(f"批量操作撤销失败，暂存的文件保留在{staging}")
+            results.extend({"op": op.get("op"), "path": op.get("path"), "status": False, "message": "未执行"} for op in params.ops[len(results):])
+        else:
+            for commit in commits:
+                commit()
+            remove_staging = True
+    finally:
+        if staging is not None and remove_staging:
+            shutil.rmtree(staging, ignore_errors=True)
+        if changed:
+            _invalidate_folder_cache(*changed)
 
+    succeeded = sum(1 for result in results if result["status"])
+    return parse_obj_as(ResponseBatch, {
+        "status": succeeded == len(results)
+        , "message": f"成功{succeeded}项，失败{len(results) - succeeded}项"
+        , "results": results
+    })
@@ -0,0 +1,105 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from server.globalObject import global_obj
+import server.apis.file_manage as fileRoute
+
+# 文件接口的异步服务层
+# file_manage中的接口都是阻塞的磁盘操作，这里放到专用线程池执行，不占用Starlette默认线程池
+# 按操作类型分为三个队列，互不影响:
+# read: 文件列表、读取文档等对延迟敏感的操作
+# write: 保存、新建、重命名等普通写操作
+# slow: 递归删除文件夹、大文档保存等耗时操作
+
+READ_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+WRITE_WORKERS = 4
+SLOW_WORKERS = 2
+# 请求体超过该大小的保存视为大文档写入，放入slow队列
+BIG_WRITE_BYTES = 4 * 1024 * 1024
+
+class FileService:
+    def __init__(self, read_workers=READ_WORKERS, write_workers=WRITE_WORKERS, slow_workers=SLOW_WORKERS):
+        self._executors = {
+            "read": ThreadPoolExecutor(read_workers, thread_name_prefix="egbenz-file-read")
+            , "write": ThreadPoolExecutor(write_workers, thread_name_prefix="egbenz-file-write")
+            , "slow": ThreadPoolExecutor(slow_workers, thread_name_prefix="egbenz-file-slow")
+        }
+
+    async def run(self, queue, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executors[queue], func, *args)
+
+    def shutdown(self):
+        # 等待已提交的写操作完成
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+
+def _run(queue, func, *args):
+    return global_obj.file_service.run(queue, func, *args)
+
+def _write_queue(request: Request):
+    try:
+        size = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        size = 0
+    return "slow" if size > BIG_WRITE_BYTES else "write"
+
+async def get_all_files(params: fileRoute.ParamsPath):
+    return await _run("read", fileRoute.get_all_files, params)
+
+async def get_folders(params: fileRoute.ParamFolders):
+    return await _run("read", fileRoute.get_folders, params)
+
+async def get_file_raw(params: fileRoute.ParamsFile):
+    response, iterator, content_length = await _run("read", fileRoute._prepare_file_raw, params)
+    if iterator is None:
+        return response
+    return StreamingResponse(_iterate("read", iterator), media_type="application/json", headers={"Content-Length": str(content_length)})
+
+async def get_file_page(params: fileRoute.ParamsFilePage):
+    return await _run("read", fileRoute.get_file_page, params)
+
+async def get_file_children(params: fileRoute.ParamsFileChildren):
+    return await _run("read", fileRoute.get_file_children, params)
+
+async def new_folder(params: fileRoute.ParamsNewFolder):
+    return await _run("write", fileRoute.new_folder, params)
+
+async def new_ai_file(params: fileRoute.ParamsNewFile):
+    return await _run("write", fileRoute.new_ai_file, params)
+
+async def update_file(params: fileRoute.ParamUpdateFile, request: Request):
+    return await _run(_write_queue(request), fileRoute.update_file, params)
+
+async def patch_file(params: fileRoute.ParamPatchFile, request: Request):
+    return await _run(_write_queue(request), fileRoute.patch_file, params)
+
+async def rename_path(params: fileRoute.ParamRename):
+    return await _run("write", fileRoute.rename_path, params)
+
+async def _iterate(queue, iterator):
+    """在指定线程池中逐块读取同步生成器
+    """
+    while True:
+        chunk = await _run(queue, next, iterator, None)
+        if chunk is None:
+            break
+        yield chunk
+
+async def get_tree(params: fileRoute.ParamsTree):
+    path, depth, error = await _run("read", fileRoute._prepare_tree, params)
+    if error is not None:
+        return error
+    iterator = fileRoute._iter_tree(path, depth)
+    return StreamingResponse(_iterate("read", iterator), media_type="application/x-ndjson")
+
+async def batch(params: fileRoute.ParamBatch):
+    # 批量操作可能包含大量删除，放入slow队列
+    return await _run("slow", fileRoute.batch, params)
+
+async def delete_path(params: fileRoute.ParamsDelete):
+    # 删除文件夹需要递归删除，判断路径类型本身也是磁盘操作，删除统一放入slow队列
+    return await _run("slow", fileRoute.delete_path, params)
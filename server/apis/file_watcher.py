@@ -0,0 +1,346 @@
+import os
+import json
+import asyncio
+import threading
+import traceback
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from server.globalObject import global_obj
+from server.apis.file_manage import file_is_hidden, _entry_is_hidden, _invalidate_folder_cache
+
+# watchdog为可选依赖(Linux下基于inotify), 未安装时使用定时轮询
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# 轮询间隔(秒)，同时也是检查工作目录是否变化的间隔
+POLL_INTERVAL = 2
+# SSE心跳间隔(秒)
+HEARTBEAT_INTERVAL = 15
+# 单个客户端最多积压的事件数，超出后清空队列并通知客户端全量刷新
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+def _is_sub_path(path, parent):
+    return path.startswith(parent.rstrip(os.sep) + os.sep)
+
+def scan_tree(root):
+    """遍历工作目录，返回索引 {绝对路径: (是否文件夹, 修改时间, 大小, inode)}
+    隐藏文件和文件夹不进入索引
+    """
+    index = {}
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if _entry_is_hidden(entry):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                        st = entry.stat()
+                        index[entry.path] = (is_dir, st.st_mtime_ns, st.st_size, entry.inode())
+                    except OSError:
+                        continue
+                    if is_dir:
+                        stack.append(entry.path)
+        except OSError:
+            continue
+    return index
+
+def diff_tree(old, new):
+    """比较两次索引，生成新建/删除/重命名/修改事件
+    inode相同的删除+新建视为重命名; 文件夹被新建/删除/重命名时不再输出其下子项的事件
+    """
+    deleted = set(old) - set(new)
+    created = set(new) - set(old)
+
+    moved = []
+    created_by_inode = {}
+    for path in created:
+        inode = new[path][3]
+        if inode:
+            created_by_inode.setdefault((inode, new[path][0]), []).append(path)
+    for path in sorted(deleted, key=len):
+        key = (old[path][3], old[path][0])
+        if key[0] and created_by_inode.get(key):
+            dest_path = created_by_inode[key].pop()
+            moved.append((path, dest_path))
+    for path, dest_path in moved:
+        deleted.discard(path)
+        created.discard(dest_path)
+
+    events = []
+    moved_dirs = [(path, dest_path) for path, dest_path in moved if old[path][0]]
+    for path, dest_path in sorted(moved, key=lambda x: len(x[0])):
+        if any(_is_sub_path(path, src) and _is_sub_path(dest_path, dst) for src, dst in moved_dirs):
+            continue
+        events.append(_event('moved', path, old[path][0], dest_path))
+
+    deleted_dirs = [path for path in deleted if old[path][0]] + [path for path, _ in moved_dirs]
+    for path in sorted(deleted, key=len):
+        if not any(_is_sub_path(path, parent) for parent in deleted_dirs):
+            events.append(_event('deleted', path, old[path][0]))
+
+    created_dirs = [path for path in created if new[path][0]] + [dest_path for _, dest_path in moved_dirs]
+    for path in sorted(created, key=len):
+        if not any(_is_sub_path(path, parent) for parent in created_dirs):
+            events.append(_event('created', path, new[path][0]))
+
+    for path in set(old) & set(new):
+        if not new[path][0] and old[path][1:3] != new[path][1:3]:
+            events.append(_event('modified', path, False))
+    return events
+
+def _event(event_type, path, is_dir, dest_path=""):
+    """推送给客户端的事件, folder为需要刷新的父目录
+    """
+    return {
+        "type": event_type
+        , "path": path
+        , "dest_path": dest_path
+        , "is_dir": is_dir
+        , "folder": os.path.dirname(path)
+    }
+
+class _WatchdogHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ('created', 'deleted', 'moved', 'modified'):
+            return
+        # 文件夹的修改事件只是子项变化，子项本身会有对应的事件
+        if event.event_type == 'modified' and event.is_directory:
+            return
+        try:
+            self.watcher._on_fs_event(event.event_type, event.src_path, event.is_directory, getattr(event, 'dest_path', ''))
+        except Exception:
+            traceback.print_exc()
+
+class FileWatcher:
+    """工作目录监听
+    维护工作目录的内存索引, 变化时增量更新索引并通过SSE推送事件;
+    有watchdog时使用系统通知(Linux下为inotify)，否则定时轮询对比索引;
+    轮询只在有客户端订阅时进行，没有订阅者时不遍历工作目录
+    """
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.root = None
+        self.index = {}
+        # 索引是否已建立，轮询模式下没有订阅者时丢弃索引
+        self._index_ready = False
+        self.mode = 'polling'
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._observer = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="egbenz-file-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._stop_observer()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _workspace_root(self):
+        path = global_obj.config.get('工作目录')
+        if path and os.path.isdir(path):
+            return os.path.abspath(path)
+        return None
+
+    def _loop(self):
+        while True:
+            try:
+                root = self._workspace_root()
+                if root != self.root:
+                    self._switch_root(root)
+                elif self.root and self._observer is None:
+                    self._poll()
+            except Exception:
+                traceback.print_exc()
+            if self._stop.wait(self.poll_interval):
+                break
+
+    def _switch_root(self, root):
+        """工作目录变化时重建索引，并通知客户端全量刷新
+        """
+        self._stop_observer()
+        with self._lock:
+            self.root = root
+            self.index = {}
+            self._index_ready = False
+        self.mode = 'polling'
+        if root and Observer is not None:
+            try:
+                observer = Observer()
+                observer.schedule(_WatchdogHandler(self), root, recursive=True)
+                observer.start()
+                self._observer = observer
+                self.mode = 'watchdog'
+            except Exception:
+                # 如inotify监听数量超过上限，退化为轮询
+                traceback.print_exc()
+                self._observer = None
+        if self._observer is not None:
+            index = scan_tree(root)
+            with self._lock:
+                self.index = index
+                self._index_ready = True
+        elif root:
+            self._poll()
+        self._publish({"type": "reset", "path": root or "", "dest_path": "", "is_dir": True, "folder": root or ""})
+
+    def _stop_observer(self):
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+                self._observer.join(timeout=1)
+            except Exception:
+                traceback.print_exc()
+            self._observer = None
+
+    def _poll(self):
+        with self._lock:
+            has_subscribers = bool(self._subscribers)
+        if not has_subscribers:
+            with self._lock:
+                self.index = {}
+                self._index_ready = False
+            return
+        index = scan_tree(self.root)
+        with self._lock:
+            # 重新建立索引时不产生事件，客户端订阅时会获取最新列表
+            events = diff_tree(self.index, index) if self._index_ready else []
+            self.index = index
+            self._index_ready = True
+        for event in events:
+            self._publish(event)
+
+    def _is_hidden(self, path):
+        # 路径中任意一级是隐藏文件/文件夹都忽略
+        root = self.root
+        if not root or not _is_sub_path(path, root):
+            return True
+        current = root
+        for part in os.path.relpath(path, root).split(os.sep):
+            current = os.path.join(current, part)
+            if file_is_hidden(current):
+                return True
+        return False
+
+    def _on_fs_event(self, event_type, path, is_dir, dest_path=""):
+        """watchdog事件: 增量更新索引后推送
+        """
+        path = os.path.abspath(path)
+        dest_path = os.path.abspath(dest_path) if dest_path else ""
+        if event_type == 'moved':
+            src_hidden, dest_hidden = self._is_hidden(path), self._is_hidden(dest_path)
+            # 移入/移出隐藏目录分别视为新建/删除
+            if src_hidden and dest_hidden:
+                return
+            if src_hidden:
+                # 原子保存把隐藏的临时文件重命名为目标文件，目标已存在时是修改
+                with self._lock:
+                    exists = dest_path in self.index
+                event_type, path, dest_path = 'modified' if exists else 'created', dest_path, ""
+            elif dest_hidden:
+                event_type, dest_path = 'deleted', ""
+        elif self._is_hidden(path):
+            return
+
+        with self._lock:
+            if event_type in ('deleted', 'moved'):
+                sub_index = {}
+                for key in [key for key in self.index if key == path or _is_sub_path(key, path)]:
+                    sub_index[key] = self.index.pop(key)
+                if event_type == 'moved':
+                    for key, value in sub_index.items():
+                        self.index[dest_path + key[len(path):]] = value
+            if event_type in ('created', 'modified'):
+                try:
+                    st = os.stat(path)
+                    self.index[path] = (is_dir, st.st_mtime_ns, st.st_size, st.st_ino)
+                except OSError:
+                    return
+                if is_dir:
+                    self.index.update(scan_tree(path))
+        self._publish(_event(event_type, path, is_dir, dest_path))
+
+    def subscribe(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = loop
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _publish(self, event):
+        # 文件内容修改不会更新目录修改时间，需要主动清除文件夹列表缓存
+        if event["path"]:
+            _invalidate_folder_cache(event["path"])
+        if event["dest_path"]:
+            _invalidate_folder_cache(event["dest_path"])
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_queue_put, queue, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(queue)
+
+    async def stream(self, request: Request):
+        """SSE事件流, 第一条为ready事件，之后推送文件变化事件
+        """
+        queue = self.subscribe()
+        try:
+            yield _sse({"type": "ready", "mode": self.mode, "path": self.root or ""})
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield _sse(event)
+        finally:
+            self.unsubscribe(queue)
+
+def _queue_put(queue, event):
+    if queue.full():
+        # 客户端处理不过来，丢弃积压的事件，让客户端重新获取列表
+        while not queue.empty():
+            queue.get_nowait()
+        event = {"type": "resync", "path": "", "dest_path": "", "is_dir": True, "folder": ""}
+    queue.put_nowait(event)
+
+def _sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+async def watch_files(request: Request):
+    """订阅工作目录的文件变化(SSE)
+    """
+    return StreamingResponse(
+        global_obj.watcher.stream(request)
+        , media_type="text/event-stream"
+        , headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,308 @@
+import asyncio
+import itertools
+import time
+import traceback
+
+import httpx
+from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from server.globalObject import global_obj
+
+# SD/VITS请求转发
+# 每个后端使用一个长期存在的httpx.AsyncClient，复用连接，启动时创建，关闭时释放
+# 请求体和响应体按块原样转发，不在主进程解析(生成图片的响应包含几十MB的base64图片)
+
+# 后端名 -> 地址的配置项，多个实例的地址用逗号分隔，如 "http://localhost:8082, http://localhost:8092"
+BACKENDS = {
+    "sd": "SD URL"
+    , "vits": "VITS URL"
+}
+
+# 转发表: 路径前缀 -> 后端名，前缀下的所有接口原样转发到后端的同名地址
+FORWARD_ROUTES = [
+    ("/sdapi/", "sd")
+    , ("/vits/", "vits")
+]
+FORWARD_METHODS = ["GET", "POST"]
+
+# 连接池配置
+FORWARD_MAX_CONNECTIONS = 20
+FORWARD_MAX_KEEPALIVE = 10
+# 空闲连接保持时间(秒)
+FORWARD_KEEPALIVE_EXPIRY = 60
+FORWARD_CONNECT_TIMEOUT = 10
+# 默认超时(秒)，生成图片可能需要很长时间
+FORWARD_DEFAULT_TIMEOUT = 1800
+# 按路由设置超时，未设置的使用默认超时
+FORWARD_TIMEOUTS = {
+    "/sdapi/v1/progress": 10
+    , "/sdapi/v1/get_selected_model": 30
+    , "/sdapi/v1/interrupt": 30
+    , "/sdapi/v1/set_sd_model": 600
+    , "/sdapi/v1/magic_draw": 1800
+    , "/sdapi/v1/magic_txt2img": 1800
+    , "/sdapi/v1/magic_img2img": 1800
+    , "/vits/text2voice": 600
+}
+
+# 原样转发给后端的请求头
+FORWARD_REQUEST_HEADERS = ("content-type", "content-length", "accept", "accept-encoding")
+# 原样返回给客户端的响应头，响应体不解压，需要同时返回content-encoding
+FORWARD_RESPONSE_HEADERS = ("content-type", "content-encoding", "content-length")
+
+# 健康检查: 定期请求后端的轻量接口，能返回(状态码<500)即认为可用
+# SD/VITS在模型加载完成后才开始监听端口，连接失败说明进程未启动或仍在加载
+HEALTH_PATHS = {
+    "sd": "/sdapi/v1/get_selected_model"
+    , "vits": "/docs"
+}
+HEALTH_INTERVAL = 5
+HEALTH_TIMEOUT = 3
+# 连续失败该次数后熔断，请求直接返回503，直到健康检查恢复
+CIRCUIT_FAILURE_THRESHOLD = 2
+# 熔断时建议客户端重试的间隔(秒)
+CIRCUIT_RETRY_AFTER = HEALTH_INTERVAL
+
+# 实例状态
+STATE_UNKNOWN = "unknown"
+STATE_STARTING = "starting"
+STATE_READY = "ready"
+STATE_DOWN = "down"
+
+def backend_of(path):
+    """根据转发表判断请求转发的后端，不需要转发时返回None
+    """
+    for prefix, backend in FORWARD_ROUTES:
+        if path.startswith(prefix):
+            return backend
+    return None
+
+def _parse_urls(value):
+    return [url.strip().rstrip('/') for url in (value or '').split(',') if url.strip()]
+
+class Upstream:
+    """后端的一个实例
+    """
+    def __init__(self, backend, url):
+        self.backend = backend
+        self.url = url
+        # 正在转发的请求数
+        self.outstanding = 0
+        # unknown: 尚未检查; starting: 启动后还没有成功过; ready: 可用; down: 曾经可用，现在不可用
+        self.state = STATE_UNKNOWN
+        self.failures = 0
+        self.last_error = ""
+        self.last_check = 0
+        self.latency = None
+
+    def available(self):
+        return self.state in (STATE_UNKNOWN, STATE_READY)
+
+    def record_success(self, latency=None):
+        self.state = STATE_READY
+        self.failures = 0
+        self.last_error = ""
+        if latency is not None:
+            self.latency = latency
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = str(error) or error.__class__.__name__
+        # 从未成功过的实例认为仍在启动，可用的实例连续失败多次后熔断
+        if self.state in (STATE_UNKNOWN, STATE_STARTING):
+            self.state = STATE_STARTING
+        elif self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.state = STATE_DOWN
+
+    def status(self):
+        return {
+            "url": self.url
+            , "state": self.state
+            , "outstanding": self.outstanding
+            , "failures": self.failures
+            , "last_error": self.last_error
+            , "last_check": self.last_check
+            , "latency_ms": None if self.latency is None else round(self.latency * 1000, 1)
+        }
+
+class Forwarder:
+    def __init__(self, max_connections=FORWARD_MAX_CONNECTIONS, max_keepalive=FORWARD_MAX_KEEPALIVE
+                 , keepalive_expiry=FORWARD_KEEPALIVE_EXPIRY, timeouts=None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections
+            , max_keepalive_connections=max_keepalive
+            , keepalive_expiry=keepalive_expiry
+        )
+        self.timeouts = dict(FORWARD_TIMEOUTS, **(timeouts or {}))
+        self._clients = {}
+        # 后端名 -> 实例列表，配置版本变化时重新解析
+        self._upstreams = {}
+        self._config_version = None
+        # (后端名, 地址) -> 实例，重新解析配置后保留进行中的请求数
+        self._instances = {}
+        # 进行中请求数相同时轮流选择
+        self._counter = itertools.count()
+        self._probe_client = None
+        self._health_task = None
+
+    def _create_client(self):
+        return httpx.AsyncClient(
+            limits=self.limits
+            , timeout=httpx.Timeout(FORWARD_DEFAULT_TIMEOUT, connect=FORWARD_CONNECT_TIMEOUT)
+        )
+
+    async def start(self):
+        for backend in BACKENDS:
+            if backend not in self._clients:
+                self._clients[backend] = self._create_client()
+        if self._health_task is None:
+            self._probe_client = httpx.AsyncClient(timeout=HEALTH_TIMEOUT)
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+            await self._probe_client.aclose()
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    async def _health_loop(self):
+        while True:
+            try:
+                upstreams = [upstream for backend in BACKENDS for upstream in self.upstreams(backend)]
+                await asyncio.gather(*[self.probe(upstream) for upstream in upstreams])
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    async def probe(self, upstream):
+        start = time.perf_counter()
+        upstream.last_check = time.time()
+        try:
+            response = await self._probe_client.get(upstream.url + HEALTH_PATHS[upstream.backend])
+            if response.status_code >= 500:
+                upstream.record_failure(f"HTTP {response.status_code}")
+            else:
+                upstream.record_success(time.perf_counter() - start)
+        except httpx.HTTPError as e:
+            upstream.record_failure(e)
+
+    def status(self):
+        """所有后端实例的状态，用于/backends
+        """
+        return {backend: [upstream.status() for upstream in self.upstreams(backend)] for backend in BACKENDS}
+
+    def client(self, backend):
+        # 未经过startup(如直接调用)时按需创建
+        if backend not in self._clients:
+            self._clients[backend] = self._create_client()
+        return self._clients[backend]
+
+    def timeout(self, path):
+        return httpx.Timeout(self.timeouts.get(path, FORWARD_DEFAULT_TIMEOUT), connect=FORWARD_CONNECT_TIMEOUT)
+
+    def upstreams(self, backend):
+        """后端的所有实例，后端地址只在配置版本变化时重新读取
+        """
+        config = global_obj.config
+        version = (id(config), config.version)
+        if version != self._config_version:
+            upstreams = {}
+            for name, key in BACKENDS.items():
+                upstreams[name] = []
+                for url in _parse_urls(config.get(key)):
+                    if (name, url) not in self._instances:
+                        self._instances[(name, url)] = Upstream(name, url)
+                    upstreams[name].append(self._instances[(name, url)])
+            self._upstreams = upstreams
+            self._config_version = version
+        return self._upstreams.get(backend, [])
+
+    def pick(self, backend):
+        """在可用(未熔断)的实例中选择进行中请求最少的，没有可用实例时返回None
+        """
+        upstreams = [upstream for upstream in self.upstreams(backend) if upstream.available()]
+        if not upstreams:
+            return None
+        start = next(self._counter)
+        candidates = [upstreams[(start + i) % len(upstreams)] for i in range(len(upstreams))]
+        return min(candidates, key=lambda upstream: upstream.outstanding)
+
+    def _unavailable(self, backend):
+        """后端没有可用实例时立即返回503，不等待超时
+        """
+        upstreams = self.upstreams(backend)
+        if not upstreams:
+            raise HTTPException(status_code=503, detail=f"未配置{BACKENDS[backend]}")
+        if any(upstream.state == STATE_STARTING for upstream in upstreams):
+            msg = f"{backend}服务启动中，请稍后重试"
+        else:
+            msg = f"{backend}服务不可用，请稍后重试"
+        return JSONResponse(
+            status_code=503
+            , content={"status": False, "msg": msg, "backends": [upstream.status() for upstream in upstreams]}
+            , headers={"Retry-After": str(CIRCUIT_RETRY_AFTER)}
+        )
+
+    async def proxy(self, backend, request: Request):
+        """流式转发请求，后端的状态码和content-type原样返回
+        """
+        upstream = self.pick(backend)
+        if upstream is None:
+            return self._unavailable(backend)
+        path = request.url.path
+        headers = {key: request.headers[key] for key in FORWARD_REQUEST_HEADERS if key in request.headers}
+        client = self.client(backend)
+        upstream_request = client.build_request(
+            request.method
+            , upstream.url + path
+            , params=str(request.query_params) or None
+            , headers=headers
+            , content=request.stream() if request.method == "POST" else None
+            , timeout=self.timeout(path)
+        )
+
+        upstream.outstanding += 1
+        try:
+            response = await client.send(upstream_request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # 连接失败说明后端不可用，计入熔断
+            upstream.outstanding -= 1
+            upstream.record_failure(e)
+            return self._unavailable(backend)
+        except BaseException:
+            upstream.outstanding -= 1
+            raise
+
+        released = False
+        async def release():
+            # 响应读取完成、客户端断开或发送失败时释放，只执行一次
+            nonlocal released
+            if released:
+                return
+            released = True
+            upstream.outstanding -= 1
+            await response.aclose()
+
+        async def iter_body():
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await release()
+
+        response_headers = {key: response.headers[key] for key in FORWARD_RESPONSE_HEADERS if key in response.headers}
+        return StreamingResponse(
+            iter_body()
+            , status_code=response.status_code
+            , headers=response_headers
+            , background=BackgroundTask(release)
+        )
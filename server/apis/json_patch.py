@@ -0,0 +1,122 @@
+import copy
+import re
+
+# JSON Patch(RFC 6902)的实现，支持 add/remove/replace/move/copy/test 操作
+# 操作直接修改传入的文档，调用方在失败时需要丢弃该文档
+
+class JsonPatchError(Exception):
+    pass
+
+# 数组下标只能是不带前导0的ASCII数字('²'等字符isdigit()也为True，int()会失败)
+_INDEX_PATTERN = re.compile(r'0|[1-9][0-9]*')
+
+def _parse_pointer(pointer):
+    """把JSON Pointer('/children/0/text')拆分为路径数组
+    """
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"路径格式错误: {pointer}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in pointer[1:].split("/")]
+
+def _list_index(container, part, allow_end=False):
+    if allow_end and part == "-":
+        return len(container)
+    if not _INDEX_PATTERN.fullmatch(part):
+        raise JsonPatchError(f"数组下标错误: {part}")
+    index = int(part)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchError(f"数组下标越界: {part}")
+    return index
+
+def _resolve_parent(doc, pointer):
+    """返回(父节点, 最后一级key)，根节点不能作为操作对象
+    """
+    parts = _parse_pointer(pointer)
+    if not parts:
+        raise JsonPatchError("不支持对根节点操作")
+    node = doc
+    for part in parts[:-1]:
+        node = _get_child(node, part)
+    return node, parts[-1]
+
+def _get_child(node, part):
+    if isinstance(node, dict):
+        if part not in node:
+            raise JsonPatchError(f"路径不存在: {part}")
+        return node[part]
+    if isinstance(node, list):
+        return node[_list_index(node, part)]
+    raise JsonPatchError(f"路径不存在: {part}")
+
+def _get(doc, pointer):
+    node = doc
+    for part in _parse_pointer(pointer):
+        node = _get_child(node, part)
+    return node
+
+def _add(doc, pointer, value):
+    parent, key = _resolve_parent(doc, pointer)
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_list_index(parent, key, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"路径不存在: {pointer}")
+
+def _remove(doc, pointer):
+    parent, key = _resolve_parent(doc, pointer)
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"路径不存在: {pointer}")
+        return parent.pop(key)
+    if isinstance(parent, list):
+        return parent.pop(_list_index(parent, key))
+    raise JsonPatchError(f"路径不存在: {pointer}")
+
+def _replace(doc, pointer, value):
+    parent, key = _resolve_parent(doc, pointer)
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"路径不存在: {pointer}")
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent[_list_index(parent, key)] = value
+    else:
+        raise JsonPatchError(f"路径不存在: {pointer}")
+
+def apply_patch(doc, ops):
+    """按顺序执行patch操作，返回修改后的文档
+    """
+    for op in ops:
+        if not isinstance(op, dict) or "path" not in op:
+            raise JsonPatchError(f"操作格式错误: {op}")
+        name = op.get("op")
+        pointer = op["path"]
+        if name in ("add", "replace", "test") and "value" not in op:
+            raise JsonPatchError(f"{name}操作缺少value")
+        if name in ("move", "copy") and "from" not in op:
+            raise JsonPatchError(f"{name}操作缺少from")
+        if not isinstance(pointer, str):
+            raise JsonPatchError(f"路径格式错误: {pointer}")
+        if name in ("move", "copy") and not isinstance(op["from"], str):
+            raise JsonPatchError(f"路径格式错误: {op['from']}")
+
+        if name == "add":
+            _add(doc, pointer, op["value"])
+        elif name == "remove":
+            _remove(doc, pointer)
+        elif name == "replace":
+            _replace(doc, pointer, op["value"])
+        elif name == "move":
+            if pointer.startswith(op["from"] + "/"):
+                raise JsonPatchError("不能移动到自身的子节点")
+            _add(doc, pointer, _remove(doc, op["from"]))
+        elif name == "copy":
+            _add(doc, pointer, copy.deepcopy(_get(doc, op["from"])))
+        elif name == "test":
+            if _get(doc, pointer) != op["value"]:
+                raise JsonPatchError(f"test操作失败: {pointer}")
+        else:
+            raise JsonPatchError(f"不支持的操作: {name}")
+    return doc
@@ -1,8 +1,15 @@
 # markdown语法正则合集
 import re,os
+import json
 import base64
+import hashlib
+import threading
+import traceback
 import requests
 import argparse
+import time
+from collections import OrderedDict
+from server.apis import ai_format, atomic_file
 
 regs = [
     {'name': 'title', 'reg': r'^#{1,6} .*'}
@@ -32,53 +39,69 @@ class Token:
     def __str__(self):
         return f'{self.type}: {self.value}'
 
+def _compile_regs(regs, with_anchored=True):
+    """把regs合并成一个按顺序匹配的正则, 每条规则是一个命名分组
+    alternation从左到右尝试, 第一个命中的分组即为结果, 与逐条匹配的优先级一致
+    """
+    parts = []
+    for reg in regs:
+        pattern = reg['reg']
+        # '^'开头的规则只在文本缓存为空(即当前位置)时才生效，合并后由调用方选择是否包含
+        if pattern.startswith('^'):
+            if not with_anchored:
+                continue
+            pattern = pattern[1:]
+        parts.append(f"(?P<{reg['name']}>{pattern})")
+    return re.compile('|'.join(parts))
+
+# 文本缓存为空时使用(包含'^'开头的规则)
+_block_pattern = _compile_regs(regs)
+# 文本缓存不为空时使用(去掉'^'开头的规则)
+_inline_pattern = _compile_regs(regs, with_anchored=False)
+
 class Tokenizer:
     def __init__(self, input_):
         self.input = input_
 
     def tokenize(self):
-        tokens = []
+        return list(self.iter_tokens())
+
+    def iter_tokens(self):
+        """逐个产出token
+        使用预编译的合并正则在原字符串上按位置匹配(不切片), 普通文本按区间收集
+        """
+        text = self.input
+        length = len(text)
         i = 0
-        text_cache = ""
-        while i < len(self.input):
-            # 遍历正则表达式
-            for reg in regs:
-                # 匹配
-                # 如果正则匹配是'^'开头，则判断text_cache是否为空，不为空则默认失败，不判断
-                if reg['reg'].startswith('^') and text_cache != "":
-                    continue
-
-                match = re.match(reg['reg'], self.input[i:])
-                if match:
-                    # 如果文本缓存不为空，则添加到tokens中
-                    if text_cache:
-                        tokens.append(Token('text', text_cache))
-                        text_cache = ""
-                    # 添加token
-                    tokens.append(Token(reg['name'], match.group()))
-                    # 更新i
-                    i += len(match.group())
-                    break
-
-            # 如果全都没匹配上，则缓存在文本区，并+1
+        while i < length:
+            # 文本缓存为空，所有规则都可以在当前位置匹配
+            match = _block_pattern.match(text, i)
+            if match:
+                yield Token(match.lastgroup, match.group())
+                i = match.end()
+                continue
+
+            # 当前字符进入文本缓存，之后只需查找下一个非'^'规则命中的位置
+            text_start = i
+            match = _inline_pattern.search(text, i + 1)
             if not match:
-                if i < len(self.input):
-                    text_cache += self.input[i]
-                i += 1
-                
-            
-                
-        return tokens
+                # 和原实现保持一致: 末尾未被任何token结束的文本不输出
+                break
+            yield Token('text', text[text_start:match.start()])
+            yield Token(match.lastgroup, match.group())
+            i = match.end()
 
 class Parser:
-    def __init__(self, tokens, base_path="/", intercept_path="static"):
+    def __init__(self, tokens, base_path="/", intercept_path="static", image_resolver=None):
         self.tokens = tokens
         self.base_path = base_path
         self.intercept_path = intercept_path
+        self.image_resolver = image_resolver or ImageResolver(base_path, intercept_path)
 
     # 实现token到aditor的转换
     def parse(self):
         aditorNodes = []
+        imageNodes = []
         last_node = None
         for token in self.tokens:
             if token.type == 'text':
@@ -125,7 +148,9 @@ class Parser:
                     aditorNodes.append(paragraphNode)
                     last_node = paragraphNode
             elif token.type == 'image':
-                node = self._create_image(src2path(token.value.split('](')[1].rstrip(')'), self.base_path, self.intercept_path))
+                # 图片地址在全部token解析完后统一并发解析
+                node = self._create_image(token.value.split('](')[1].rstrip(')'))
+                imageNodes.append(node)
                 paragraphNode = self._create_paragraph()
                 paragraphNode["children"].append(node)
                 aditorNodes.append(paragraphNode)
@@ -180,8 +205,14 @@ class Parser:
                 aditorNodes.append(quoteNode)
                 last_node = quoteNode
         
+        self._resolve_images(imageNodes)
         return aditorNodes
 
+    def _resolve_images(self, imageNodes):
+        resolved = self.image_resolver.resolve_all([node["data"]["src"] for node in imageNodes])
+        for node in imageNodes:
+            node["data"]["src"] = resolved[node["data"]["src"]]
+
     def _create_paragraph(self):
         return {
             "name": "aditorParagraph",
@@ -278,13 +309,8 @@ class Parser:
             "children": []
         }
 
-def markdown_to_html(markdown_text, base_path="/", intercept_path="static", aditorVersion="0.0.15", egbenzVersion="0.0.7"):
-    tokenizer = Tokenizer(markdown_text)
-    tokens = tokenizer.tokenize()
-    parser = Parser(tokens, base_path, intercept_path)
-    nodes = parser.parse()
-
-    aditor = {
+def _create_aditor(nodes, aditorVersion="0.0.15", egbenzVersion="0.0.7"):
+    return {
         "name": "aditor",
         "type": "child",
         "style": {},
@@ -295,77 +321,413 @@ def markdown_to_html(markdown_text, base_path="/", intercept_path="static", adit
         "children": nodes
     }
 
-    return aditor
+def markdown_to_html(markdown_text, base_path="/", intercept_path="static", aditorVersion="0.0.15", egbenzVersion="0.0.7", image_resolver=None):
+    tokenizer = Tokenizer(markdown_text)
+    tokens = tokenizer.tokenize()
+    parser = Parser(tokens, base_path, intercept_path, image_resolver)
+    nodes = parser.parse()
+
+    return _create_aditor(nodes, aditorVersion, egbenzVersion)
+
+# 流式转换时每个分块的最小字符数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _has_open_code(text, tokens):
+    """判断分块内是否存在未闭合的'```'
+    文本区间内出现的'```'说明code规则在该位置匹配失败(分块内没有找到结束符),
+    后续内容可能会让它匹配成功, 此时不能在这里切分
+    """
+    pos = 0
+    for token in tokens:
+        end = pos + len(token.value)
+        # '```'可能从文本区间末尾开始，跨到下一个token
+        if token.type == 'text' and text.find('```', pos, end + 2) != -1:
+            return True
+        pos = end
+    return False
+
+def iter_markdown_tokens(lines, chunk_size=STREAM_CHUNK_SIZE):
+    """把按行读取的markdown按分块分词，逐块产出token列表
+    只在行尾切分: 除code外所有规则都不跨行，切分点总是br token，
+    Parser状态在分块之间不需要保留；存在未闭合代码块时继续读取，直到代码块结束
+    """
+    chunk = []
+    chunk_len = 0
+    threshold = chunk_size
+    for line in lines:
+        chunk.append(line)
+        chunk_len += len(line)
+        if chunk_len < threshold or not line.endswith('\n'):
+            continue
+        text = ''.join(chunk)
+        tokens = Tokenizer(text).tokenize()
+        if _has_open_code(text, tokens):
+            # 阈值翻倍，避免超长代码块被反复分词
+            chunk = [text]
+            threshold *= 2
+            continue
+        yield tokens
+        chunk = []
+        chunk_len = 0
+        threshold = chunk_size
+    if chunk:
+        yield Tokenizer(''.join(chunk)).tokenize()
+
+def iter_markdown_nodes(lines, base_path="/", intercept_path="static", chunk_size=STREAM_CHUNK_SIZE, image_resolver=None):
+    """流式解析markdown，逐个产出aditor顶层节点
+    lines可以是文件对象或任意按行产出字符串的迭代器
+    """
+    # 所有分块共用一个图片解析器，重复出现的图片只解析一次
+    image_resolver = image_resolver or ImageResolver(base_path, intercept_path)
+    for tokens in iter_markdown_tokens(lines, chunk_size):
+        for node in Parser(tokens, base_path, intercept_path, image_resolver).parse():
+            yield node
+
+def _dump_aditor_stream(nodes, f, aditorVersion="0.0.15", egbenzVersion="0.0.7", indent=4):
+    """逐个节点写入.ai文件, 输出与json.dump(aditor, indent=indent)一致
+    """
+    # 用空children生成外层结构，再从'[]'处拆成头尾两部分
+    outer = json.dumps(_create_aditor([], aditorVersion, egbenzVersion), ensure_ascii=False, indent=indent)
+    head, tail = outer.rsplit('[]', 1)
+    item_indent = ' ' * indent * 2
+
+    f.write(head + '[')
+    count = 0
+    for node in nodes:
+        node_json = json.dumps(node, ensure_ascii=False, indent=indent)
+        f.write(',\n' if count else '\n')
+        f.write(item_indent + node_json.replace('\n', '\n' + item_indent))
+        count += 1
+    if count:
+        f.write('\n' + ' ' * indent)
+    f.write(']' + tail)
+    return count
+
+def markdown_save_path(file_path):
+    """markdown文件对应的.ai文件路径
+    """
+    return os.path.splitext(file_path)[0] + '.ai'
+
+def local_markdown_to_html(file_path, base_path="/", intercept_path="static", aditorVersion="0.0.15", egbenzVersion="0.0.7", stream=False, cache_dir=None, asset_dir=None, storage_format="json"):
+    """把本地markdown文件转换为同名.ai文件
+    stream=True时按块读取并逐个节点写入，内存占用与文件大小无关，此时不返回文档内容
+    cache_dir为图片编码结果的缓存目录; 设置asset_dir时图片复制到资源库, 文档中只保存引用地址
+    storage_format为.ai文件的存储格式(见ai_format)，流式转换只支持json
+    """
+    # 缺少msgpack/zstandard时退化为可用的格式
+    storage_format = ai_format.available_format(storage_format)
+    if stream and storage_format != ai_format.FORMAT_JSON:
+        raise ValueError("流式转换只支持json格式")
+    save_path = markdown_save_path(file_path)
+    image_resolver = ImageResolver(base_path, intercept_path, cache_dir=cache_dir, asset_dir=asset_dir)
+    # 先写入临时文件，转换成功后再替换，转换失败时保留原来的.ai文件
+    if stream:
+        with open(file_path, 'r', encoding='utf-8') as src, atomic_file.open_atomic(save_path, 'w', encoding='utf-8') as f:
+            _dump_aditor_stream(iter_markdown_nodes(src, base_path, intercept_path, image_resolver=image_resolver), f, aditorVersion, egbenzVersion)
+        return None
 
-def local_markdown_to_html(file_path, base_path="/", intercept_path="static", aditorVersion="0.0.15", egbenzVersion="0.0.7"):
-    save_path = file_path.replace('.md', '.ai')
     with open(file_path, 'r', encoding='utf-8') as f:
         markdown_text = f.read()
     
-    file_aditor = markdown_to_html(markdown_text, base_path, intercept_path, aditorVersion, egbenzVersion)
-    import json
-    with open(save_path, 'w', encoding='utf-8') as f:
-        json.dump(file_aditor, f, ensure_ascii=False, indent=4)
+    file_aditor = markdown_to_html(markdown_text, base_path, intercept_path, aditorVersion, egbenzVersion, image_resolver)
+    if storage_format != ai_format.FORMAT_JSON:
+        atomic_file.write_atomic(save_path, ai_format.dumps(file_aditor, storage_format))
+        return file_aditor
+
+    atomic_file.write_atomic(save_path, json.dumps(file_aditor, ensure_ascii=False, indent=4).encode('utf-8'))
 
     return file_aditor
 
+def _batch_convert_one(file_path, base_path, intercept_path, stream, cache_dir, asset_dir, storage_format):
+    """进程池中执行的单文件转换, 返回(文件路径, 耗时, 错误信息)
+    """
+    start = time.perf_counter()
+    try:
+        local_markdown_to_html(file_path, base_path, intercept_path, stream=stream, cache_dir=cache_dir, asset_dir=asset_dir, storage_format=storage_format)
+        return file_path, time.perf_counter() - start, ""
+    except Exception as e:
+        return file_path, time.perf_counter() - start, str(e)
+
+# 检查.ai文件是否完整时读取的文件末尾字节数
+OUTPUT_TAIL_BYTES = 64
+
+def _output_complete(save_path):
+    """粗略检查.ai文件是否完整写入: JSON格式以'}'结尾，compact格式有完整的文件头和内容
+    旧版本转换失败时可能留下被截断的文件，不完整的文件需要重新转换
+    """
+    try:
+        size = os.path.getsize(save_path)
+        with open(save_path, 'rb') as f:
+            head = f.read(ai_format.HEADER_SIZE)
+            if ai_format.is_compact(head):
+                return size > ai_format.HEADER_SIZE
+            f.seek(max(0, size - OUTPUT_TAIL_BYTES))
+            return f.read().rstrip().endswith(b'}')
+    except OSError:
+        return False
+
+def iter_markdown_files(dir_path, force=False):
+    """遍历目录树下所有需要转换的.md文件
+    force为False时跳过.ai文件比源文件新且完整的文件
+    """
+    for root, dirs, files in os.walk(dir_path):
+        for name in files:
+            if not name.endswith('.md'):
+                continue
+            file_path = os.path.join(root, name)
+            save_path = markdown_save_path(file_path)
+            if not force and os.path.exists(save_path) and os.path.getmtime(save_path) >= os.path.getmtime(file_path) and _output_complete(save_path):
+                continue
+            yield file_path
+
+# 批量转换时图片缓存的默认目录(位于转换目录下, 以'.'开头不会显示在文件列表中)
+IMAGE_CACHE_DIR = os.path.join('.egbenz_cache', 'images')
+
+def batch_markdown_to_html(dir_path, base_path="/", intercept_path="static", workers=None, stream=False, force=False, cache_dir=None, asset_dir=None, storage_format="json"):
+    """使用进程池把目录树下所有.md文件转换为.ai文件
+    打印每个文件的耗时以及整体的files/sec，返回(成功数, 失败数, 总耗时)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(dir_path, IMAGE_CACHE_DIR)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    start = time.perf_counter()
+    success, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_batch_convert_one, file_path, base_path, intercept_path, stream, cache_dir, asset_dir, storage_format)
+            for file_path in iter_markdown_files(dir_path, force)
+        ]
+        for future in as_completed(futures):
+            file_path, cost, error = future.result()
+            if error:
+                failed += 1
+                print(f"[失败] {file_path} {cost:.3f}s {error}")
+            else:
+                success += 1
+                print(f"[完成] {file_path} {cost:.3f}s")
+
+    total = time.perf_counter() - start
+    count = success + failed
+    speed = count / total if total > 0 else 0
+    print(f"共转换{count}个文件, 成功{success}个, 失败{failed}个, 耗时{total:.2f}s, {speed:.2f} files/sec")
+    return success, failed, total
+
 
 def src2path(src, base_path="/", intercept_path="static"):
-    # 如果src是本地路径,不是http开头,直接返回
-    if not src.startswith("http"):
-        try:
-            # 读取远程请求的图片，转成base64编码
-            # 获取图片的响应
-            response = requests.get(src)
-            # 将响应的内容转换为base64编码
-            img_base64 = base64.b64encode(response.content)
-            # 返回base64编码的字符串
-            return img_base64.decode()
-        except:
-            return src
+    return ImageResolver(base_path, intercept_path).resolve(src)
+
+def _image_local_path(src, base_path="/", intercept_path="static"):
+    # 从第一个intercept_path开始阶段，分成两部分(不包括intercept_path)
+    index = src.find(intercept_path) + len(intercept_path)
+    append_path = src[index:]
+    # 拆分为数组，重新使用python的sys.path的join方法,避免了windows和linux的路径分隔符问题
+    prepend_path = base_path.split("/")
+    append_path = append_path.split("/")
+    return os.path.join(*prepend_path, *append_path)
+
+def _image_prefix(file_path):
+    # 判断文件类型，用于base64编码前缀, 不支持的类型返回None
+    prefix = "data:image"
+    if file_path.endswith(".png"):
+        prefix += "/png"
+    elif file_path.endswith(".jpg") or file_path.endswith(".jpeg"):
+        prefix += "/jpeg"
+    elif file_path.endswith(".gif"):
+        prefix += "/gif"
+    elif file_path.endswith(".bmp"):
+        prefix += "/bmp"
     else:
-        # 从第一个intercept_path开始阶段，分成两部分(不包括intercept_path)
-        index = src.find(intercept_path) + len(intercept_path)
-        append_path = src[index:]
-        # 拆分为数组，重新使用python的sys.path的join方法,避免了windows和linux的路径分隔符问题
-        prepend_path = base_path.split("/")
-        append_path = append_path.split("/")
-        
+        return None
+    return prefix + ";base64,"
+
+# 并发读取/下载图片的线程数
+IMAGE_WORKERS = 8
+# 下载图片的超时(连接, 读取)，无响应的地址不会拖住整个转换
+IMAGE_TIMEOUT = (5, 30)
+# 内存中保留的已解析图片的总字符数上限，流式转换时内存不随图片总大小增长
+RESOLVED_MAX_BYTES = 64 * 1024 * 1024
+# 引用模式下图片资源库的目录名(位于工作目录下)和访问地址前缀
+ASSET_DIR_NAME = '.egbenz_assets'
+ASSET_URL_PREFIX = '/egbenz_assets/'
+
+class ImageResolver:
+    """图片地址解析
+    先收集文档中的所有图片地址，再用有界线程池并发读取/下载并转成base64,
+    同一地址的结果保存在按字符数限制大小的LRU中，重复出现时不再解析; 设置cache_dir时按内容哈希把编码结果缓存在磁盘上,
+    之后转换同一个目录的文档时直接复用;
+    设置asset_dir时为引用模式, 本地图片按内容哈希复制到资源库, 只返回引用地址
+    """
+    def __init__(self, base_path="/", intercept_path="static", max_workers=IMAGE_WORKERS, cache_dir=None, asset_dir=None, max_bytes=RESOLVED_MAX_BYTES):
+        self.base_path = base_path
+        self.intercept_path = intercept_path
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.asset_dir = asset_dir
+        self.max_bytes = max_bytes
+        # 已解析的地址 -> 结果，超过max_bytes时淘汰最久未使用的
+        self.resolved = OrderedDict()
+        self.resolved_bytes = 0
+        self._lock = threading.Lock()
+
+    def resolve_all(self, srcs):
+        """并发解析一组图片地址，返回{src: 结果}
+        """
+        results = {}
+        pending = []
+        for src in dict.fromkeys(srcs):
+            value = self._get(src)
+            if value is None:
+                pending.append(src)
+            else:
+                results[src] = value
+        if len(pending) == 1:
+            results[pending[0]] = self.resolve(pending[0])
+        elif pending:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                results.update(zip(pending, executor.map(self.resolve, pending)))
+        return results
+
+    def resolve(self, src):
+        value = self._get(src)
+        if value is None:
+            value = self._resolve(src)
+            self._put(src, value)
+        return value
+
+    def _get(self, src):
+        with self._lock:
+            value = self.resolved.get(src)
+            if value is not None:
+                self.resolved.move_to_end(src)
+            return value
+
+    def _put(self, src, value):
+        with self._lock:
+            if src in self.resolved or len(value) > self.max_bytes:
+                return
+            self.resolved[src] = value
+            self.resolved_bytes += len(value)
+            while self.resolved_bytes > self.max_bytes:
+                _, evicted = self.resolved.popitem(last=False)
+                self.resolved_bytes -= len(evicted)
+
+    def _resolve(self, src):
+        # 如果src是本地路径,不是http开头,直接返回
+        if not src.startswith("http"):
+            try:
+                # 读取远程请求的图片，转成base64编码
+                key = "url:" + src
+                cached = self._cache_get(key)
+                if cached is not None:
+                    return cached
+                # 获取图片的响应
+                response = requests.get(src, timeout=IMAGE_TIMEOUT)
+                # 将响应的内容转换为base64编码
+                img_base64 = base64.b64encode(response.content).decode()
+                self._cache_put(key, response.content, img_base64)
+                return img_base64
+            except:
+                return src
+
         # 读取本地图片。转成base64编码
-        file_path = os.path.join(*prepend_path, *append_path)
+        file_path = _image_local_path(src, self.base_path, self.intercept_path)
         # 判断文件是否存在
         if not os.path.exists(file_path):
             return src
-        # 判断文件类型，用于base64编码前缀
-        prefix = "data:image"
-        if file_path.endswith(".png"):
-            prefix += "/png"
-        elif file_path.endswith(".jpg") or file_path.endswith(".jpeg"):
-            prefix += "/jpeg"
-        elif file_path.endswith(".gif"):
-            prefix += "/gif"
-        elif file_path.endswith(".bmp"):
-            prefix += "/bmp"
-        else:
+        prefix = _image_prefix(file_path)
+        if prefix is None:
             return src
-        prefix += ";base64,"
+        if self.asset_dir:
+            return self._resolve_asset(src, file_path)
         try:
+            # 文件未修改(路径, 修改时间, 大小不变)时直接使用缓存
+            stat_result = os.stat(file_path)
+            key = f"file:{os.path.abspath(file_path)}:{stat_result.st_mtime_ns}:{stat_result.st_size}"
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
             with open(file_path, 'rb') as f:
                 data = f.read()
-                data_base64 = base64.b64encode(data).decode()
-            return prefix + data_base64
+            data_base64 = prefix + base64.b64encode(data).decode()
+            self._cache_put(key, data, data_base64)
+            return data_base64
         except:
             return src
 
-    
+    def _resolve_asset(self, src, file_path):
+        """引用模式: 图片复制到资源库，文件名为内容哈希，相同图片只保存一份
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            name = hashlib.sha256(data).hexdigest() + os.path.splitext(file_path)[1].lower()
+            asset_path = os.path.join(self.asset_dir, name)
+            if not os.path.exists(asset_path):
+                _write_bytes_replace(asset_path, data)
+            return ASSET_URL_PREFIX + name
+        except:
+            return src
+
+    def _cache_file(self, folder, name):
+        return os.path.join(self.cache_dir, folder, name[:2], name)
+
+    def _cache_get(self, key):
+        """根据地址key查找内容哈希，再读取内容哈希对应的编码结果
+        """
+        if not self.cache_dir:
+            return None
+        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        try:
+            with open(self._cache_file('keys', key_hash), 'r', encoding='utf-8') as f:
+                content_hash = f.read().strip()
+            with open(self._cache_file('objects', content_hash), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _cache_put(self, key, content, encoded):
+        """编码结果按内容哈希保存，相同内容的图片只保存一份
+        写入临时文件后再替换, 多个转换进程同时写入也不会读到不完整的缓存
+        """
+        if not self.cache_dir:
+            return
+        key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        content_hash = hashlib.sha256(content).hexdigest()
+        try:
+            object_path = self._cache_file('objects', content_hash)
+            if not os.path.exists(object_path):
+                _write_text_replace(object_path, encoded)
+            _write_text_replace(self._cache_file('keys', key_hash), content_hash)
+        except OSError:
+            traceback.print_exc()
+
+def _write_text_replace(path, text):
+    _write_bytes_replace(path, text.encode('utf-8'))
+
+def _write_bytes_replace(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_file.write_atomic(path, data)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-path', '--file_path', help='The path of the markdown file')
+    parser.add_argument('-s', '--stream', help='Whether to convert in streaming mode', action='store_true')
+    # 批量转换目录树下的所有markdown文件
+    parser.add_argument('-dir', '--dir_path', help='The directory of markdown files to convert in batch')
+    parser.add_argument('-w', '--workers', help='The number of worker processes for batch convert', type=int, default=None)
+    parser.add_argument('-f', '--force', help='Whether to convert files whose .ai output is up to date', action='store_true')
+    # 引用模式: 图片复制到工作目录下的资源库, 文档中只保存引用地址
+    parser.add_argument('-a', '--asset_dir', help=f'The asset store to copy images into, usually <workspace>/{ASSET_DIR_NAME}', default=None)
+    parser.add_argument('-fmt', '--storage_format', help='The storage format of .ai files: json | compact | compact+zstd', default='json')
     args = parser.parse_args()
     file_path = args.file_path
 
-    aditor = local_markdown_to_html(file_path, 'E:\egbenz', 'static')
+    if args.dir_path:
+        batch_markdown_to_html(args.dir_path, 'E:\egbenz', 'static', args.workers, args.stream, args.force, asset_dir=args.asset_dir, storage_format=args.storage_format)
+    else:
+        aditor = local_markdown_to_html(file_path, 'E:\egbenz', 'static', stream=args.stream, asset_dir=args.asset_dir, storage_format=args.storage_format)
 
 #     markdown = """
 # # 环境准备
@@ -0,0 +1,66 @@
+import functools
+import os
+import sys
+import threading
+import time
+
+from server.globalObject import global_obj
+
+# 前端使用的虚拟根目录
+DEFAULT_OPEN_PATH = "所有笔记"
+# 虚拟路径 -> 磁盘路径 的缓存条数
+PATH_CACHE_SIZE = 4096
+# 配置没有变化时，每隔一段时间重新检查工作目录是否存在(目录可能在运行期间被创建或删除)
+WORKSPACE_RECHECK_SECONDS = 5
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _map_path(path, workspace):
+    """把'所有笔记/...'转换为磁盘路径，workspace为已确认存在的工作目录或None
+    结果只由参数决定，可以直接缓存
+    """
+    if not path.startswith(DEFAULT_OPEN_PATH + '/'):
+        return path
+    path_arr = path.split('/')
+    path = os.path.join(*path_arr[1:])
+    # 如果是Linux，同时path首字母不是'/'开头
+    if sys.platform != "win32" and not path.startswith('/'):
+        path = '/' + path
+    # 如果工作目录存在，则拼接工作目录
+    if workspace:
+        # 如果path是'/'开头，则去掉
+        if path.startswith('/'):
+            path = path[1:]
+        path = os.path.join(workspace, path)
+    return path
+
+class PathResolver:
+    """虚拟路径解析
+    缓存工作目录是否存在以及规范化后的路径，配置修改(Config.version变化)后重新检查
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._workspace = None
+        self._checked_at = 0
+
+    def workspace(self):
+        """返回存在的工作目录，未设置或不存在时返回None
+        """
+        config = global_obj.config
+        state = (id(config), getattr(config, 'version', None))
+        now = time.monotonic()
+        with self._lock:
+            if state == self._state and now - self._checked_at < WORKSPACE_RECHECK_SECONDS:
+                return self._workspace
+        path = config.get('工作目录')
+        workspace = os.path.normpath(path) if path and os.path.exists(path) else None
+        with self._lock:
+            self._state = state
+            self._workspace = workspace
+            self._checked_at = now
+        return workspace
+
+    def resolve(self, path):
+        return _map_path(path, self.workspace())
+
+path_resolver = PathResolver()
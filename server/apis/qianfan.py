@@ -1,23 +1,25 @@
 import requests
 import json
 from server.globalObject import global_obj
+from server.apis.chat_client import ChatError, get_chat_client
 
+QIANFAN_CHAT_URL = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/ernie-3.5-8k-0205"
+QIANFAN_TOKEN_URL = "https://aip.baidubce.com/oauth/2.0/token"
 
-def qianfan_chat(_prompt, history=[], system="", API_KEY = None, SECRET_KEY = None):
+def _keys(API_KEY=None, SECRET_KEY=None):
     if not API_KEY:
         API_KEY = global_obj.config.get("QianFan API Key")
     if not SECRET_KEY:
         SECRET_KEY = global_obj.config.get("QianFan Secret Key")
-        
-    response_flag = True
-    msg = ""
-    response_list = []
+    return API_KEY, SECRET_KEY
+
+def _build_prompt(_prompt, history):
     prompt = history
     prompt.append({
         "role": "user",
         "content": _prompt
     })
-  
+
     # 判断整体是否是奇数，如果不是，则弹出第一个
     if len(prompt) % 2 == 0:
         prompt.pop(0)
@@ -28,19 +30,34 @@ def qianfan_chat(_prompt, history=[], system="", API_KEY = None, SECRET_KEY = No
             prompt[i]["role"] = "user"
         else:
             prompt[i]["role"] = "assistant"
+    return prompt
+
+def _payload(prompt, stream=False):
+    payload = {
+        "messages": prompt,
+        "temperature": 0.8,
+        "top_p": 0.8,
+        "penalty_score": 1,
+        "disable_search": False,
+        "enable_citation": False,
+        "response_format": "text"
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+def qianfan_chat(_prompt, history=[], system="", API_KEY = None, SECRET_KEY = None):
+    API_KEY, SECRET_KEY = _keys(API_KEY, SECRET_KEY)
+        
+    response_flag = True
+    msg = ""
+    response_list = []
+    prompt = _build_prompt(_prompt, history)
 
     try:
-        url = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/ernie-3.5-8k-0205?access_token=" + get_access_token(API_KEY, SECRET_KEY)
+        url = QIANFAN_CHAT_URL + "?access_token=" + get_access_token(API_KEY, SECRET_KEY)
         
-        payload = json.dumps({
-            "messages": prompt,
-            "temperature": 0.8,
-            "top_p": 0.8,
-            "penalty_score": 1,
-            "disable_search": False,
-            "enable_citation": False,
-            "response_format": "text"
-        })
+        payload = json.dumps(_payload(prompt))
         headers = {
             'Content-Type': 'application/json'
         }
@@ -61,6 +78,29 @@ def qianfan_chat(_prompt, history=[], system="", API_KEY = None, SECRET_KEY = No
         msg = "QianFan API error:"+str(e)
 
     return response_flag, msg, response_list
+
+async def qianfan_chat_deltas(_prompt, history=[], system="", API_KEY = None, SECRET_KEY = None):
+    """以stream模式请求千帆，逐个产生回复的文本片段
+    """
+    API_KEY, SECRET_KEY = _keys(API_KEY, SECRET_KEY)
+    prompt = _build_prompt(_prompt, history)
+    client = get_chat_client()
+    token = await get_access_token_async(API_KEY, SECRET_KEY)
+    async with client.stream("POST", QIANFAN_CHAT_URL, params={"access_token": token}, json=_payload(prompt, stream=True)) as response:
+        # 正常时每行为 "data: {...}"，最后一个片段is_end为true；出错时返回普通JSON
+        async for line in response.aiter_lines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("data:"):
+                line = line[5:].strip()
+            result = json.loads(line)
+            if "error_code" in result:
+                raise ChatError("QianFan API error:" + str(result.get("error_msg")))
+            if result.get("result"):
+                yield result["result"]
+            if result.get("is_end"):
+                break
     
 
 def get_access_token(API_KEY, SECRET_KEY):
@@ -69,6 +109,10 @@ def get_access_token(API_KEY, SECRET_KEY):
     :return: access_token，或是None(如果错误)
     """
 
-    url = "https://aip.baidubce.com/oauth/2.0/token"
     params = {"grant_type": "client_credentials", "client_id": API_KEY, "client_secret": SECRET_KEY}
-    return str(requests.post(url, params=params).json().get("access_token"))
+    return str(requests.post(QIANFAN_TOKEN_URL, params=params).json().get("access_token"))
+
+async def get_access_token_async(API_KEY, SECRET_KEY):
+    params = {"grant_type": "client_credentials", "client_id": API_KEY, "client_secret": SECRET_KEY}
+    response = await get_chat_client().post(QIANFAN_TOKEN_URL, params=params)
+    return str(response.json().get("access_token"))
@@ -3,14 +3,14 @@ from server.globalObject import global_obj
 import traceback
 import requests
 import httpx
-from urllib.parse import urlparse
 
 from pydantic import BaseModel, Field, constr, parse_obj_as
 from fastapi import Request, HTTPException
 from typing import Dict, Optional, List
-from urllib.parse import urlparse
-from server.apis.qianfan import qianfan_chat
+from server.apis.qianfan import qianfan_chat, qianfan_chat_deltas
+from server.apis.chat_client import chat_metrics, chat_stream_response
 from server.apis.pdf2html import get_page_text_and_total_pages
+from server.apis.forwarder import backend_of, FORWARD_ROUTES, FORWARD_METHODS
 
 class EgbenzRouter:
     def __init__(self, app):
@@ -19,17 +19,14 @@ class EgbenzRouter:
         self.app.add_api_route("/set_config", set_config, methods=["POST"], response_model=ConfigResponse)
         self.app.add_api_route("/pdf2html", pdf2html, methods=["POST"], response_model=ResponsePDF2HTML)
         self.app.add_api_route("/qianfan/chat", qianfan, methods=["POST"], response_model=ResponseQianfan)
+        self.app.add_api_route("/qianfan/chat/stream", qianfan_stream, methods=["POST"])
+        self.app.add_api_route("/chat_metrics", get_chat_metrics, methods=["POST"], response_model=ResponseChatMetrics)
 
 
-        # 本机转发sd，vits 等路由
-        self.app.add_api_route("/sdapi/v1/magic_draw", get_forward, methods=["POST"])
-        self.app.add_api_route("/sdapi/v1/magic_txt2img", get_forward, methods=["POST"])
-        self.app.add_api_route("/sdapi/v1/magic_img2img", get_forward, methods=["POST"])
-        self.app.add_api_route("/sdapi/v1/set_sd_model", get_forward, methods=["POST"])
-        self.app.add_api_route("/sdapi/v1/progress", get_forward, methods=["GET"])
-        self.app.add_api_route("/sdapi/v1/get_selected_model", get_forward, methods=["GET"])
-        self.app.add_api_route("/sdapi/v1/interrupt", get_forward, methods=["POST"])
-        self.app.add_api_route("/vits/text2voice", get_forward, methods=["POST"])
+        # 本机转发sd，vits 等路由，转发表中前缀下的所有接口都转发到对应后端
+        for prefix, _ in FORWARD_ROUTES:
+            self.app.add_api_route(prefix + "{path:path}", get_forward, methods=FORWARD_METHODS)
+        self.app.add_api_route("/backends", get_backends, methods=["POST"], response_model=ResponseBackends)
 
 
 class ConfigSetParams(BaseModel):
@@ -56,44 +53,30 @@ def set_config(params: ConfigSetParams):
     except Exception as e:
         return ConfigResponse(status=False, message=str(e), contents={})
     
+class ResponseBackends(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    backends: Optional[Dict] = Field(default={})
+
+async def get_backends():
+    """SD/VITS各实例的健康状态，只读取内存中的状态，直接在事件循环中执行
+    """
+    try:
+        return ResponseBackends(status=True, backends=global_obj.forwarder.status())
+    except Exception as e:
+        traceback.print_exc()
+        return ResponseBackends(status=False, message=str(e))
+
 # 转发请求接口, 不限制params类型
 async def get_forward(request: Request):
-    forward_method = request.method
-    
-    cfg = global_obj.config.get_all()
-    vits_url = cfg.get("VITS URL")
-    sd_url = cfg.get("SD URL")
-    # 如果是POST请求, 获取请求体
-    if forward_method == "POST":
-        body = await request.json()
-    # 如果是GET请求, 获取请求参数
-    else:
-        body = dict(request.query_params)
-    url = str(request.url)
-    path = urlparse(url).path
-    # 如果请求地址是/vits/开头的, 转发到VITS接口
-    async with httpx.AsyncClient(timeout=1800) as client:
-        if path.startswith("/vits/"):
-            # 使用request向本机的8082端口转发请求和相关参数
-            try:
-                if forward_method == "POST":
-                    response = await client.post(vits_url + path, json=body)
-                else:
-                    response = await client.get(vits_url + path, params=body)
-                return response.json()
-            except httpx.RequestError as e:
-                raise HTTPException(status_code=500, detail=str(e))
-        elif path.startswith("/sdapi/"):
-            try:
-                if forward_method == "POST":
-                    response = await client.post(sd_url + path, json=body)
-                else:
-                    response = await client.get(sd_url + path, params=body)
-                return response.json()
-            except httpx.RequestError as e:
-                raise HTTPException(status_code=500, detail=str(e))
-        else:
-            return {"status": False, "msg": "地址错误"}
+    # 根据转发表选择后端, 如/vits/开头的转发到VITS接口, /sdapi/开头的转发到SD接口
+    backend = backend_of(request.url.path)
+    if backend is None:
+        return {"status": False, "msg": "地址错误"}
+    try:
+        return await global_obj.forwarder.proxy(backend, request)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 # 模型管理
 class ParamsPDF2HTML(BaseModel):
@@ -130,4 +113,19 @@ def qianfan(params:ParamsQianfan):
     
     except Exception as e:
         traceback.print_exc()
-        return ResponseQianfan(status=False, message=str(e), contents=[])
\ No newline at end of file
+        return ResponseQianfan(status=False, message=str(e), contents=[])
+
+async def qianfan_stream(params:ParamsQianfan):
+    """流式返回回复，SSE事件: delta(文本片段)，done(与/qianfan/chat相同的contents，以及首字延迟ttft_ms)
+    """
+    return chat_stream_response("qianfan", "QianFan", qianfan_chat_deltas(params.text, params.history))
+
+class ResponseChatMetrics(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    metrics: Optional[Dict] = Field(default={})
+
+def get_chat_metrics():
+    """流式聊天接口的首字延迟和总耗时
+    """
+    return ResponseChatMetrics(status=True, metrics=chat_metrics.stats())
@@ -0,0 +1,321 @@
+import os
+import re
+import queue
+import itertools
+import sqlite3
+import threading
+import traceback
+
+from pydantic import BaseModel, Field, constr, parse_obj_as
+from typing import List, Optional
+
+from server.globalObject import global_obj
+import server.apis.ai_format as ai_format
+from server.apis.path_resolver import path_resolver
+
+# 模型管理
+class ParamsSearch(BaseModel):
+    query: constr(min_length=1)
+    limit: Optional[int] = Field(default=20)
+
+class ResponseSearch(BaseModel):
+    status: bool
+    message: Optional[str] = Field(default="")
+    results: Optional[List] = Field(default=[])
+
+# 英文/数字按单词切分，中日韩文字按二元组切分
+_word_reg = re.compile(r'[0-9a-z_]+|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_cjk_reg = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]')
+# 摘要中命中位置前后保留的字符数
+SNIPPET_RADIUS = 40
+# 后台索引线程检查工作目录是否变化的间隔(秒)
+WORKSPACE_CHECK_INTERVAL = 5
+
+def extract_text(doc):
+    """提取.ai文档树中的文本: aditorText的text, aditorCode的代码, aditorKatex的公式
+    """
+    texts = []
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        name = node.get("name")
+        data = node.get("data") or {}
+        if name == "aditorText" and node.get("text"):
+            texts.append(node["text"])
+        elif name == "aditorCode" and data.get("code"):
+            texts.append(data["code"])
+        elif name == "aditorKatex" and data.get("katex"):
+            texts.append(data["katex"])
+        # 逆序入栈保证按文档顺序输出
+        stack.extend(reversed(node.get("children") or []))
+    return "\n".join(texts)
+
+def tokenize(text):
+    """切分为空格分隔的词，用于写入FTS5索引
+    FTS5默认分词器不能切分中文，这里预先把中文切成二元组
+    """
+    tokens = []
+    for word in _word_reg.findall(text.lower()):
+        if _cjk_reg.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+def _match_query(query):
+    """把搜索词转换为FTS5查询，所有词都需要命中
+    单个中文字符使用前缀匹配二元组
+    """
+    terms = []
+    for token in tokenize(query):
+        if len(token) == 1 and _cjk_reg.match(token):
+            terms.append(f'"{token}"*')
+        else:
+            terms.append(f'"{token}"')
+    return " ".join(terms)
+
+def _snippet(text, query):
+    """截取命中位置附近的文本作为摘要
+    """
+    lower_text = text.lower()
+    candidates = [query.strip().lower()] + [token for token in tokenize(query)]
+    pos = -1
+    for candidate in candidates:
+        if candidate:
+            pos = lower_text.find(candidate)
+            if pos != -1:
+                break
+    pos = max(pos, 0)
+    start = max(pos - SNIPPET_RADIUS, 0)
+    end = min(pos + SNIPPET_RADIUS * 2, len(text))
+    snippet = text[start:end].replace("\n", " ")
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet = snippet + "..."
+    return snippet
+
+class SearchIndex:
+    """.ai文档全文索引, 使用sqlite FTS5保存在磁盘上
+    files表保存路径、修改时间和原文(用于摘要), docs表为倒排索引, rowid与files.id一致
+    文件操作通过submit提交，由后台线程依次写入索引; 后台线程同时在工作目录变化时重新同步
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        # 路径 -> 最新提交的update_file序号，连续保存同一文档时只索引最后一次
+        self._latest = {}
+        self._latest_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+        self._root = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, raw TEXT)")
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(name, body, tokenize='unicode61')")
+        self._conn.commit()
+
+    def start(self):
+        with self._latest_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="egbenz-search-index", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=WORKSPACE_CHECK_INTERVAL)
+        with self._lock:
+            self._conn.close()
+
+    def submit(self, action, *args):
+        """提交索引操作(update_file/delete_path/rename_path)到后台线程，不等待完成
+        """
+        self.start()
+        seq = None
+        if action == 'update_file':
+            seq = next(self._seq)
+            with self._latest_lock:
+                self._latest[os.path.abspath(args[0])] = seq
+        self._queue.put((action, args, seq))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._check_workspace()
+            try:
+                task = self._queue.get(timeout=WORKSPACE_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if task is None:
+                break
+            action, args, seq = task
+            if seq is not None:
+                path = os.path.abspath(args[0])
+                with self._latest_lock:
+                    # 已有更新的保存在排队，跳过
+                    if self._latest.get(path) != seq:
+                        continue
+                    del self._latest[path]
+            try:
+                getattr(self, action)(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def _check_workspace(self):
+        """工作目录(配置修改后)变化时同步新工作目录的索引
+        """
+        try:
+            root = path_resolver.workspace()
+            if root != self._root:
+                self._root = root
+                if root and os.path.isdir(root):
+                    self.sync(root)
+        except Exception:
+            traceback.print_exc()
+
+    def update_file(self, path, doc=None):
+        """索引单个.ai文件，doc为空时从磁盘读取
+        """
+        path = os.path.abspath(path)
+        try:
+            if doc is None:
+                doc = ai_format.load_file(path)
+            mtime = os.path.getmtime(path)
+        except Exception:
+            traceback.print_exc()
+            return
+        self._write(path, mtime, extract_text(doc))
+
+    def _write(self, path, mtime, raw):
+        name = " ".join(tokenize(os.path.splitext(os.path.basename(path))[0]))
+        body = " ".join(tokenize(raw))
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM files WHERE path=?", (path,)).fetchone()
+            if row:
+                self._conn.execute("UPDATE files SET mtime=?, raw=? WHERE id=?", (mtime, raw, row[0]))
+                self._conn.execute("DELETE FROM docs WHERE rowid=?", (row[0],))
+                doc_id = row[0]
+            else:
+                doc_id = self._conn.execute("INSERT INTO files (path, mtime, raw) VALUES (?, ?, ?)", (path, mtime, raw)).lastrowid
+            self._conn.execute("INSERT INTO docs (rowid, name, body) VALUES (?, ?, ?)", (doc_id, name, body))
+            self._conn.commit()
+
+    def delete_path(self, path):
+        """删除文件或文件夹(包括其下所有文件)的索引
+        """
+        path = os.path.abspath(path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM files WHERE path=? OR substr(path, 1, ?)=?"
+                , (path, len(prefix), prefix)
+            ).fetchall()
+            self._delete_ids([row[0] for row in rows])
+            self._conn.commit()
+
+    def _delete_ids(self, ids):
+        for doc_id in ids:
+            self._conn.execute("DELETE FROM docs WHERE rowid=?", (doc_id,))
+            self._conn.execute("DELETE FROM files WHERE id=?", (doc_id,))
+
+    def rename_path(self, path, new_path):
+        """重命名文件或文件夹后更新索引中的路径
+        """
+        path = os.path.abspath(path)
+        new_path = os.path.abspath(new_path)
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, path FROM files WHERE path=? OR substr(path, 1, ?)=?"
+                , (path, len(prefix), prefix)
+            ).fetchall()
+            for doc_id, old_path in rows:
+                self._conn.execute("UPDATE files SET path=? WHERE id=?", (new_path + old_path[len(path):], doc_id))
+            self._conn.commit()
+        # 文件名参与搜索，重命名文件时重建该文件的索引
+        if os.path.isfile(new_path) and new_path.endswith('.ai'):
+            self.update_file(new_path)
+
+    def sync(self, root):
+        """和工作目录同步: 索引新增或修改过的.ai文件，删除已不存在的文件
+        """
+        root = os.path.abspath(root)
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT path, mtime FROM files").fetchall())
+        seen = set()
+        for folder, dirs, files in os.walk(root):
+            if self._stop.is_set():
+                return
+            # 跳过隐藏目录
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if not name.endswith('.ai') or name.startswith('.'):
+                    continue
+                path = os.path.join(folder, name)
+                seen.add(path)
+                try:
+                    if indexed.get(path) != os.path.getmtime(path):
+                        self.update_file(path)
+                except OSError:
+                    continue
+        prefix = root.rstrip(os.sep) + os.sep
+        missing = [path for path in indexed if path.startswith(prefix) and path not in seen]
+        with self._lock:
+            for path in missing:
+                row = self._conn.execute("SELECT id FROM files WHERE path=?", (path,)).fetchone()
+                if row:
+                    self._delete_ids([row[0]])
+            self._conn.commit()
+
+    def search(self, query, limit=20):
+        """按bm25排序返回命中的文档，文件名的权重高于正文
+        """
+        match = _match_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT files.path, files.raw, bm25(docs, 5.0, 1.0) AS score FROM docs"
+                " JOIN files ON files.id = docs.rowid"
+                " WHERE docs MATCH ? ORDER BY score LIMIT ?"
+                , (match, limit)
+            ).fetchall()
+        return [{
+            "path": path
+            , "name": os.path.basename(path)
+            , "score": -score
+            , "snippet": _snippet(raw, query)
+        } for path, raw, score in rows]
+
+def get_search_index():
+    """全局搜索索引, 未启用时返回None
+    """
+    return getattr(global_obj, 'search_index', None)
+
+def sync_workspace():
+    """启动后台索引线程，线程中同步工作目录的索引，工作目录修改后重新同步
+    """
+    search_index = get_search_index()
+    if search_index is not None:
+        search_index.start()
+
+def search(params: ParamsSearch):
+    search_index = get_search_index()
+    if search_index is None:
+        return parse_obj_as(ResponseSearch, {"status":False, "message":"搜索索引未启用"})
+    try:
+        results = search_index.search(params.query, params.limit)
+        return parse_obj_as(ResponseSearch, {"status":True, "results": results})
+    except Exception as e:
+        traceback.print_exc()
+        return parse_obj_as(ResponseSearch, {"status":False, "message": f"搜索失败:{e}"})
@@ -0,0 +1,93 @@
+# /file 接口性能测试
+# 对比原来的 json.load + pydantic + FastAPI序列化 路径和直接拼接文件内容的快速路径
+# 快速路径直接返回文件内容，大文档分块流式返回；分别统计文档缓存未命中(计算文档版本)和命中的情况
+# 生成 1KB ~ 50MB 的.ai文档，统计耗时和峰值内存(tracemalloc)
+# 用法: python -m server.tools.bench_file_response [--max_mb 50] [--repeat 3]
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import parse_obj_as
+
+import server.apis.file_manage as fileRoute
+
+def build_doc(size):
+    # 重复段落节点直到达到指定字节数
+    paragraph = {
+        "name": "aditorParagraph", "type": "child", "style": {}, "data": {},
+        "children": [{"name": "aditorText", "type": "leaf", "style": {"color": "rgb(0,0,0)"}, "data": {}, "text": "这是一段测试文本 benchmark text"}]
+    }
+    count = max(size // len(json.dumps(paragraph)), 1)
+    return {"name": "aditor", "type": "child", "style": {}, "data": {"version": "0.0.15"}, "children": [paragraph] * count}
+
+def legacy_get_file(params):
+    # 原/file实现: 解析文档, pydantic校验, 再由FastAPI序列化
+    with open(params.path, 'r', encoding='utf8') as f:
+        file_json = json.load(f)
+    response = parse_obj_as(fileRoute.ResponseFile, {
+        "status": True
+        , "type": "file"
+        , "name": os.path.basename(params.path)
+        , "path": params.path
+        , "update_time": os.path.getmtime(params.path)
+        , "doc": file_json
+    })
+    return JSONResponse(content=jsonable_encoder(response)).body
+
+async def _read_streaming(response):
+    return b''.join([chunk async for chunk in response.body_iterator])
+
+def raw_get_file_warm(params):
+    response = fileRoute.get_file_raw(params)
+    if isinstance(response, fileRoute.StreamingResponse):
+        return asyncio.run(_read_streaming(response))
+    return response.body
+
+def raw_get_file_cold(params):
+    fileRoute._doc_cache.invalidate(params.path)
+    return raw_get_file_warm(params)
+
+def measure(func, params, repeat):
+    costs = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        body = func(params)
+        costs.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        # 确认输出是合法的JSON
+        assert body.startswith(b'{')
+    return min(costs), peak
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_mb', help='The max size of document in MB', type=float, default=50)
+    parser.add_argument('--repeat', help='Repeat times of each case', type=int, default=3)
+    args = parser.parse_args()
+
+    sizes = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024]
+    sizes = [size for size in sizes if size <= args.max_mb * 1024 * 1024]
+
+    print(f"{'size(KB)':>12} {'legacy(ms)':>12} {'cold(ms)':>10} {'warm(ms)':>10} {'legacy peak(MB)':>16} {'cold peak(MB)':>14}")
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            path = os.path.join(folder, f"bench_{size}.ai")
+            with open(path, 'w', encoding='utf8') as f:
+                json.dump(build_doc(size), f)
+            params = fileRoute.ParamsFile(path=path)
+
+            legacy_cost, legacy_peak = measure(legacy_get_file, params, args.repeat)
+            cold_cost, cold_peak = measure(raw_get_file_cold, params, args.repeat)
+            # 放入文档缓存，命中时不需要计算文档版本
+            fileRoute._load_entry(path)
+            warm_cost, _ = measure(raw_get_file_warm, params, args.repeat)
+            print(f"{os.path.getsize(path) / 1024:>12.1f} {legacy_cost * 1000:>12.2f} {cold_cost * 1000:>10.2f} {warm_cost * 1000:>10.2f} {legacy_peak / 1024 / 1024:>16.2f} {cold_peak / 1024 / 1024:>14.2f}")
@@ -0,0 +1,50 @@
+# md2aditor 分词器性能测试
+# 生成 10KB ~ 10MB 的markdown文本，统计Tokenizer耗时，用于确认耗时随输入大小线性增长
+# 用法: python -m server.tools.bench_md2aditor [--max_mb 10]
+
+import argparse
+import time
+
+from server.apis.md2aditor import Tokenizer
+
+SAMPLE = """# 标题
+这是一段普通文本，包含**加粗**、*斜体*和[链接](https://example.com)。
+行内公式$E=mc^2$以及表格|a|b|
+1. 列表项
+> 引用内容
+```python
+print("hello")
+```
+$$\\sum_{i=0}^n i$$
+---
+![图片](static/images/test.png)
+
+"""
+
+def build_markdown(size):
+    # 重复样例文本直到达到指定字节数
+    repeat = size // len(SAMPLE.encode('utf-8')) + 1
+    return SAMPLE * repeat
+
+def bench(size):
+    markdown = build_markdown(size)
+    start = time.perf_counter()
+    tokens = Tokenizer(markdown).tokenize()
+    cost = time.perf_counter() - start
+    return len(markdown.encode('utf-8')), len(tokens), cost
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_mb', help='The max size of markdown in MB', type=float, default=10)
+    args = parser.parse_args()
+
+    sizes = []
+    size = 10 * 1024
+    while size <= args.max_mb * 1024 * 1024:
+        sizes.append(size)
+        size *= 10
+
+    print(f"{'size(KB)':>12} {'tokens':>10} {'cost(s)':>10} {'MB/s':>10}")
+    for size in sizes:
+        real_size, token_count, cost = bench(size)
+        print(f"{real_size / 1024:>12.1f} {token_count:>10} {cost:>10.4f} {real_size / 1024 / 1024 / cost:>10.2f}")
@@ -0,0 +1,84 @@
+# .ai文件存储格式迁移工具
+# 遍历目录下的.ai文件，转换为指定的存储格式(json | compact | compact+zstd)，和保存文档一样使用file_manage._write_doc_atomic写入，
+# 中途失败不会损坏原文件，文件权限保持不变
+# 同时统计转换前后的文件大小，以及和JSON相比的读取耗时
+# 用法: python -m server.tools.migrate_ai_format <dir_path> [--format compact] [--dry_run] [--config egbenz.config.cfg]
+
+import argparse
+import os
+import time
+
+from server.globalObject import global_obj
+import server.apis.ai_format as ai_format
+
+def iter_ai_files(dir_path):
+    for folder, dirs, files in os.walk(dir_path):
+        # 跳过隐藏目录
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.endswith('.ai') and not name.startswith('.'):
+                yield os.path.join(folder, name)
+
+def load_cost(data, repeat):
+    costs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ai_format.loads(data)
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+def migrate(dir_path, fmt, dry_run=False, repeat=3):
+    from server.apis.file_manage import _write_doc_atomic
+    total_before = total_after = 0
+    total_json_cost = total_cost = 0.0
+    count = 0
+    for path in iter_ai_files(dir_path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            doc = ai_format.loads(data)
+            json_data = ai_format.json_dumps_bytes(doc)
+            new_data = ai_format.dumps(doc, fmt)
+            # 转换结果必须能还原出相同的文档
+            if ai_format.loads(new_data) != doc:
+                raise ValueError("转换后的文档不一致")
+        except Exception as e:
+            print(f"跳过 {path}: {e}")
+            continue
+
+        json_cost = load_cost(json_data, repeat)
+        cost = load_cost(new_data, repeat)
+        count += 1
+        total_before += len(data)
+        total_after += len(new_data)
+        total_json_cost += json_cost
+        total_cost += cost
+        print(f"{path}: {len(data) / 1024:.1f}KB -> {len(new_data) / 1024:.1f}KB, load {json_cost * 1000:.2f}ms(json) -> {cost * 1000:.2f}ms")
+        if not dry_run and new_data != data:
+            _write_doc_atomic(path, doc, fmt)
+
+    if count == 0:
+        print("没有找到.ai文件")
+        return
+    print(f"共{count}个文件: {total_before / 1024:.1f}KB -> {total_after / 1024:.1f}KB ({total_after / max(total_before, 1):.1%})"
+          f", load {total_json_cost * 1000:.2f}ms(json) -> {total_cost * 1000:.2f}ms")
+    if dry_run:
+        print("dry run, 没有修改文件")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir_path', help='The folder containing .ai files')
+    parser.add_argument('--format', help='Target storage format: json | compact | compact+zstd', default=ai_format.FORMAT_COMPACT)
+    parser.add_argument('--dry_run', help='Only report the savings, do not modify files', action='store_true')
+    parser.add_argument('--repeat', help='Repeat times of load benchmark', type=int, default=3)
+    # JSON格式的分页索引写入配置中工作目录下的索引目录
+    parser.add_argument('--config', help='The egbenz config file', default='egbenz.config.cfg')
+    args = parser.parse_args()
+
+    from server.apis.config import Config
+    global_obj.register('config', Config(args.config, watch=False))
+
+    fmt = ai_format.available_format(args.format)
+    if fmt != args.format:
+        print(f"缺少依赖，{args.format}格式退化为{fmt}")
+    migrate(args.dir_path, fmt, args.dry_run, args.repeat)
@@ -32,6 +32,10 @@ export default defineConfig({
         target: "http://127.0.0.1:8080",
         changeOrigin: true,
         rewrite: path => path.replace(/^\/api/, '')
+      },
+      "/egbenz_assets": {
+        target: "http://127.0.0.1:8080",
+        changeOrigin: true
       }
     }
   }